@@ -0,0 +1,762 @@
+"""
+ASYNCIO DOWNLOAD ENGINE
+"""
+import os
+import json
+import time
+import asyncio
+from typing import Union, Optional, Callable, Iterable, AsyncIterator
+import aiohttp
+from colorama import Style, Fore
+from lib import card as dl
+from lib import settings as cfg
+from lib import core
+from lib import net
+from lib import mtgpics
+from lib.constants import console
+from lib.index import index
+from lib.httpcache import cache
+from lib.manifest import manifest
+
+
+class AsyncDownload:
+    """
+    Downloads a card list using coroutines instead of threads.
+    Scryfall lookups, MTGP card pages and images are all fetched on one event loop.
+    """
+
+    def __init__(self, download):
+        # Download instance collecting fails and basic lands
+        self.download = download
+        self.session: Optional[aiohttp.ClientSession] = None
+        # Requests in flight, shared by tasks making the same request
+        self.flights: dict = {}
+
+    def run(self, cards: Iterable) -> None:
+        """
+        Download every card in the list, returning once all are complete.
+        :param cards: List of card names, detailed card strings, or card data
+        """
+        asyncio.run(self.start(cards))
+
+    async def start(self, cards: Iterable) -> None:
+        """
+        Schedule a download task for each card, limiting how many run at once.
+        :param cards: List of card names, detailed card strings, or card data
+        """
+        connector = aiohttp.TCPConnector(limit=0, limit_per_host=cfg.async_per_host)
+        timeout = aiohttp.ClientTimeout(sock_connect=net.TIMEOUT, sock_read=net.TIMEOUT)
+        async with aiohttp.ClientSession(
+            connector=connector, timeout=timeout, headers=dict(net.session.headers)
+        ) as self.session:
+            slots = asyncio.Semaphore(cfg.async_tasks)
+            tasks = set()
+            batch = []
+            try:
+                async for card in self.iter_cards(cards):
+                    # Resolve detailed cards in batches
+                    if self.download.is_detailed(card):
+                        batch.append(card)
+                        if len(batch) < cfg.batch_size:
+                            continue
+                        item: Union[str, dict, list] = batch
+                        batch = []
+                    else:
+                        item = card
+                    await slots.acquire()
+                    task = asyncio.ensure_future(self.download_item(item))
+                    task.add_done_callback(lambda t: slots.release())
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            except Exception as e:
+                # Still finish the cards read so far
+                console.alert(
+                    f"{Fore.RED}ERROR:{Style.RESET_ALL} "
+                    f"Couldn't read the rest of the list ({e})"
+                )
+            if batch:
+                tasks.add(asyncio.ensure_future(self.download_item(batch)))
+            if tasks:
+                await asyncio.gather(*tasks)
+
+    @staticmethod
+    async def iter_cards(cards: Iterable) -> AsyncIterator:
+        """
+        Iterate the card list, reading lazily fetched lists off the event loop.
+        :param cards: List of card names, detailed card strings, or card data
+        :return: Async iterator of the cards
+        """
+        if isinstance(cards, list):
+            for card in cards:
+                yield card
+            return
+        loop = asyncio.get_event_loop()
+        it = iter(cards)
+        while True:
+            card = await loop.run_in_executor(None, next, it, None)
+            if card is None:
+                return
+            yield card
+
+    async def download_item(self, item: Union[str, dict, list]) -> None:
+        """
+        Download an item from the card list.
+        :param item: Card name, detailed card string, card data, or batch of detailed cards
+        """
+        if isinstance(item, list):
+            await self.download_batch(item)
+        elif isinstance(item, dict):
+            await self.download_dict(item)
+        elif self.download.is_detailed(item):
+            await self.download_detailed(item)
+        else:
+            await self.download_normal(item)
+        console.tick(len(item) if isinstance(item, list) else 1)
+
+    # NETWORK
+
+    async def coalesce(self, key: Optional[tuple], func: Callable, *args):
+        """
+        Run the coroutine, or wait for the matching one already running.
+        :param key: Key identifying the call, None if it can't be shared
+        :param func: Coroutine function to run if nothing matching is in flight
+        :return: Result of the call, shared with every task that asked for it
+        """
+        if key is None:
+            return await func(*args)
+        task = self.flights.get(key)
+        if task is None:
+            task = self.flights[key] = asyncio.ensure_future(func(*args))
+            task.add_done_callback(lambda t: self.flights.pop(key, None))
+        # One caller being cancelled mustn't cancel it for the others
+        return await asyncio.shield(task)
+
+    async def request(self, method: str, url: str, **kwargs) -> bytes:
+        """
+        Rate limited request, retrying transient errors.
+        Identical requests made at the same time share one response.
+        :param method: HTTP method, ex: GET
+        :param url: URL to request
+        :return: Response body
+        """
+        key = net.request_key(method, url, **kwargs)
+        return await self.coalesce(key, self.read, method, url, kwargs)
+
+    async def read(self, method: str, url: str, kwargs: dict) -> bytes:
+        """
+        Rate limited request, using cached responses while fresh.
+        Stale responses are revalidated with a conditional GET.
+        :param method: HTTP method, ex: GET
+        :param url: URL to request
+        :param kwargs: Arguments for the request
+        :return: Response body
+        """
+        # The cache is on disk, so it's read and written off the event loop
+        loop = asyncio.get_event_loop()
+        key = net.normalize_url(url)
+        cacheable = cache.cacheable(method, **kwargs)
+        entry = await loop.run_in_executor(None, cache.get, key) if cacheable else None
+        if entry:
+            if cache.is_fresh(entry):
+                return entry["body"]
+            kwargs = dict(kwargs, headers=cache.validators(entry))
+
+        status, headers, body = await self.send(method, url, kwargs)
+        if entry and status == 304:
+            # Unchanged since it was cached
+            await loop.run_in_executor(None, cache.revalidated, key)
+            return entry["body"]
+        if cacheable and status == 200:
+            await loop.run_in_executor(None, cache.put, key, dict(headers), body)
+        return body
+
+    async def send(self, method: str, url: str, kwargs: dict) -> tuple:
+        """
+        Rate limited request, retrying transient errors.
+        :param method: HTTP method, ex: GET
+        :param url: URL to request
+        :param kwargs: Arguments for the request
+        :return: Response status, headers and body
+        """
+        breaker = net.get_breaker(url)
+        attempts: dict = {}
+        while True:
+            net.check_breaker(breaker, url)
+            await self.limit(url)
+            start = time.monotonic()
+            try:
+                async with self.session.request(method, url, **kwargs) as r:
+                    if breaker:
+                        breaker.record(
+                            r.status not in net.RETRY_STATUSES,
+                            time.monotonic() - start,
+                        )
+                    if r.status in net.RETRY_STATUSES:
+                        r.raise_for_status()
+                    return r.status, r.headers, await r.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if breaker and not isinstance(e, aiohttp.ClientResponseError):
+                    breaker.record(False, time.monotonic() - start)
+                wait = self.retry_wait(e, attempts, url)
+                if wait is None:
+                    raise
+            await asyncio.sleep(wait)
+
+    async def get(self, url: str, **kwargs) -> bytes:
+        """
+        Rate limited GET request.
+        :param url: URL to request
+        :return: Response body
+        """
+        return await self.request("GET", url, **kwargs)
+
+    async def get_json(self, url: str, **kwargs) -> Union[dict, list]:
+        """
+        Rate limited GET request returning json data.
+        :param url: URL to request
+        :return: Decoded json response
+        """
+        return json.loads(await self.get(url, **kwargs))
+
+    async def limit(self, url: str) -> None:
+        """
+        Wait until the rate limit for this URL's host allows another request.
+        :param url: URL being requested
+        """
+        bucket = net.get_bucket(url)
+        if bucket:
+            wait = bucket.reserve()
+            if wait:
+                await asyncio.sleep(wait)
+
+    @staticmethod
+    def retry_wait(e: Exception, attempts: dict, url: str) -> Optional[float]:
+        """
+        Count a failed request against its error class's retries.
+        :param e: Exception raised by the request
+        :param attempts: Retries made so far for this request by error class
+        :param url: URL being requested
+        :return: Seconds to wait before retrying, None if the error isn't worth retrying
+        """
+        if isinstance(e, asyncio.TimeoutError):
+            error: Optional[str] = "timeout"
+        elif isinstance(e, aiohttp.ClientResponseError):
+            error = net.RETRY_STATUSES.get(e.status)
+        elif isinstance(e, (aiohttp.ClientError, net.IncompleteDownload)):
+            error = "connection"
+        else:
+            error = None
+        if not error:
+            return None
+        headers = getattr(e, "headers", None) or {}
+        wait = net.retry_delay(error, attempts, headers.get("Retry-After"))
+        if wait is None:
+            raise net.TransientError(f"{error} error for {url}: {e}") from e
+        return wait
+
+    async def download_file(self, url: str, path: str) -> Optional[dict]:
+        """
+        Stream a file to disk, retrying transient errors and resuming where they stopped.
+        Tasks downloading the same file to the same path share one download.
+        :param url: URL of the file
+        :param path: Path to save the file to
+        :return: ETag, size and hash of the downloaded file, None if unsuccessful
+        """
+        key = ("FILE", net.normalize_url(url), os.path.abspath(path))
+        return await self.coalesce(key, self.retry_download, url, path)
+
+    async def retry_download(self, url: str, path: str) -> Optional[dict]:
+        """
+        Stream a file to disk, retrying transient errors and resuming where they stopped.
+        :param url: URL of the file
+        :param path: Path to save the file to
+        :return: ETag, size and hash of the downloaded file, None if unsuccessful
+        """
+        attempts: dict = {}
+        while True:
+            try:
+                return await self.fetch_file(url, path)
+            except (
+                aiohttp.ClientError,
+                asyncio.TimeoutError,
+                net.IncompleteDownload,
+            ) as e:
+                wait = self.retry_wait(e, attempts, url)
+                if wait is None:
+                    return None
+            except (ValueError, TypeError):
+                return None
+            await asyncio.sleep(wait)
+
+    async def fetch_file(self, url: str, path: str) -> dict:
+        """
+        Stream a file to disk, resuming a partial download and moving it into place.
+        :param url: URL of the file
+        :param path: Path to save the file to
+        :return: ETag, size and hash of the downloaded file
+        """
+        part, offset = net.get_partial(path, url)
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        breaker = net.get_breaker(url)
+        net.check_breaker(breaker, url)
+        await self.limit(url)
+        start = time.monotonic()
+        try:
+            r = await self.session.get(url, headers=headers)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if breaker:
+                breaker.record(False, time.monotonic() - start)
+            raise
+        if breaker:
+            breaker.record(r.status not in net.RETRY_STATUSES, time.monotonic() - start)
+        async with r:
+            # Partial file is stale, start over
+            if r.status == 416:
+                os.remove(part)
+                return await self.fetch_file(url, path)
+            r.raise_for_status()
+
+            # Server ignored the range request
+            if r.status != 206:
+                offset = 0
+            with open(part, "ab" if offset else "wb") as f:
+                async for chunk in r.content.iter_chunked(net.CHUNK_SIZE):
+                    f.write(chunk)
+            return net.finish_download(part, path, r.headers, offset)
+
+    # SCRYFALL RESOLUTION
+
+    async def search_card_prints(self, name: str) -> list:
+        """
+        Return json data for each print of a card, newest first.
+        :param name: Exact card name
+        :return: List of card data
+        """
+        if cfg.bulk_data:
+            return core.search_card_prints(name)
+        return (await self.get_json(core.get_search_url(name)))["data"]
+
+    async def get_card_named(self, name: str, set_code: Optional[str] = None) -> dict:
+        """
+        Return json data for a card using a fuzzy name lookup.
+        :param name: Card name, can be partial or misspelled
+        :param set_code: Set code to look in, ex: mh2
+        :return: Dict of card data
+        """
+        if cfg.bulk_data:
+            return core.get_card_named(name, set_code)
+        return await self.get_json(core.get_named_url(name, set_code))
+
+    async def get_cards_collection(self, identifiers: list) -> list:
+        """
+        Return json data for a batch of cards.
+        :param identifiers: List of up to 75 Scryfall card identifiers
+        :return: List of card data for each identifier that was found
+        """
+        if cfg.bulk_data:
+            return core.get_cards_collection(identifiers)
+        res = await self.request(
+            "POST", core.collection_url, json={"identifiers": identifiers}
+        )
+        return json.loads(res)["data"]
+
+    async def download_normal(self, card: str) -> None:
+        """
+        Download a card with no defined set code.
+        :param card: Card name
+        """
+        card = card.replace("\n", "")
+        results = []
+
+        # Basic land?
+        if card in cfg.basic_lands:
+            self.download.basics.append(card)
+            return
+        try:
+            # Remove full art entries
+            prepared = [
+                c
+                for c in await self.search_card_prints(card)
+                if not cfg.exclude_fullart or c["full_art"] is False
+            ]
+
+            # Download every print at once, a print that errors counts as failed
+            if cfg.download_all:
+                results = [
+                    r is True
+                    for r in await asyncio.gather(
+                        *[self.download_card(c) for c in prepared],
+                        return_exceptions=True,
+                    )
+                ]
+
+            # Loop through prints of this card until one downloads
+            else:
+                for c in prepared:
+                    if await self.download_card(c):
+                        results = [True]
+                        break
+                    results.append(False)
+        except net.TransientError as e:
+            self.download.unavailable(card, e)
+            results.append(False)
+        except Exception:
+            # Try named lookup
+            try:
+                result = await self.download_card(await self.get_card_named(card))
+            except net.TransientError as e:
+                self.download.unavailable(card, e)
+                result = False
+            except Exception:
+                console.out.append(f"{card} not found!")
+                result = False
+            results.append(result)
+        if sum(results) == 0:
+            self.download.fails.append(card)
+
+    async def download_detailed(self, item: str) -> None:
+        """
+        Download card with defined set code.
+        :param item: Card name -- set code
+        """
+        name, set_code = self.download.split_detailed(item)
+        try:
+            result = await self.download_card(await self.get_card_named(name, set_code))
+        except net.TransientError as e:
+            self.download.unavailable(item, e)
+            result = False
+        except Exception:
+            console.out.append(f"{name} not found!")
+            result = False
+        if not result:
+            self.download.fails.append(item)
+
+    async def download_batch(self, items: list) -> None:
+        """
+        Resolve a batch of detailed cards at once, then download them.
+        Cards the batch couldn't match fall back on a fuzzy lookup.
+        :param items: List of detailed card strings
+        """
+        identifiers = []
+        for item in items:
+            name, set_code = self.download.split_detailed(item)
+            identifiers.append({"name": name, "set": set_code.lower()})
+        try:
+            cards = await self.get_cards_collection(identifiers)
+        except Exception:
+            cards = []
+        resolved = self.download.match_detailed(items, identifiers, cards)
+        await asyncio.gather(
+            *[
+                self.download_dict(resolved[item], item)
+                if resolved.get(item)
+                else self.download_detailed(item)
+                for item in items
+            ]
+        )
+
+    async def download_dict(self, card: dict, item: Optional[str] = None) -> None:
+        """
+        Downloads a card with previously fetched scryfall data.
+        :param card: Dict of card data
+        :param item: Line from the card list this card was resolved from
+        """
+        try:
+            result = await self.download_card(card)
+        except net.TransientError as e:
+            self.download.unavailable(item or card["name"], e)
+            result = False
+        except Exception:
+            console.out.append(f"{card['name']} not found!")
+            result = False
+        if not result:
+            self.download.fails.append(item or card["name"])
+
+    # CARD DOWNLOADS
+
+    async def download_card(self, c: dict) -> bool:
+        """
+        Download each face of a card.
+        :param c: Dict of card data
+        :return: True if the card downloaded
+        """
+        # Already downloaded on a previous run?
+        card_class = dl.get_card_class(c)
+        if dl.is_downloaded(c, card_class):
+            return True
+
+        # Creating the card does no network I/O
+        card = card_class(c)
+        if not isinstance(card, dl.MDFC):
+            front = await self.download_face(
+                card, card.name, card.filename, card.scrylink
+            )
+            if card.deferred:
+                # MTG Pics was unavailable, try it again after the run
+                self.download.deferred.append(c)
+                return True
+            if not front:
+                core.log(card.name, card.set, card_id=card.id, reason=card.error)
+            return front
+
+        # Download the back alongside the front, both from one card page scrape
+        if not cfg.only_scryfall:
+            await self.get_faces(card)
+        front, back = await asyncio.gather(
+            self.download_face(card, card.name, card.filename, card.scrylink),
+            self.download_face(
+                card,
+                card.name_back,
+                card.filename_back,
+                getattr(card, "scrylink_back", None),
+                True,
+            ),
+        )
+        if card.deferred:
+            self.download.deferred.append(c)
+            return True
+        if not front and not back:
+            core.log(card.name, card.set, card_id=card.id, reason=card.error)
+            return False
+        if not front:
+            core.log(card.name, card.set, "failed_front", card.id, card.error)
+        elif not back:
+            core.log(card.name_back, card.set, "failed_back", card.id, card.error)
+        return True
+
+    async def download_face(
+        self, card, name: str, path: str, scrylink: str, back: bool = False
+    ) -> bool:
+        """
+        Download one face of a card from MTG Pics, falling back on Scryfall.
+        :param card: Card object
+        :param name: Name of this face
+        :param path: Image save path
+        :param scrylink: Art crop scryfall URI
+        :param back: Is this the back side?
+        :return: True if the MTGP image downloaded, or Scryfall in Scryfall only mode
+        """
+        if cfg.only_scryfall:
+            return await self.download_scryfall(card, name, path, scrylink, back)
+        if await self.download_mtgp(
+            card, f"{name} (Back)" if back else name, path, back
+        ):
+            return True
+        if card.fallback:
+            await self.download_scryfall(card, name, path, scrylink, back)
+        return False
+
+    async def download_mtgp(self, card, name: str, path: str, back: bool) -> bool:
+        """
+        Download image from MTG Pics.
+        :param card: Card object
+        :param name: Name of card to use for console output
+        :param path: Image save path
+        :param back: Is this the back side?
+        :return: True if successful
+        """
+        # Is this the back face?
+        img_link = (await self.get_faces(card))[1 if back else 0]
+        if not img_link:
+            return False
+
+        # Check path for overwrites, only a path claimed here is released
+        path, claimed_path = f"{cfg.mtgp}/{path}", None
+        if not cfg.overwrite:
+            path = claimed_path = card.check_path(path)
+        try:
+            info = await self.download_file(img_link, path)
+        except net.TransientError as e:
+            card.skip_mtgp(e)
+            return False
+        except OSError:
+            return False
+        finally:
+            if claimed_path:
+                card.release_path(claimed_path)
+        if not info:
+            return False
+        manifest.add(card.id, "back" if back else "front", "mtgp", img_link, path, info)
+        console.out.append(
+            f"{Fore.GREEN}MTGP:{Style.RESET_ALL} {name} [{card.set.upper()}]"
+        )
+        return True
+
+    async def resolve_code(self, card) -> str:
+        """
+        Get the MTGP code for a card, scraping the checklists it needs as coroutines.
+        :param card: Card object
+        :return: MTGP linkage
+        """
+        card.promo = card.check_for_promo()
+        name = card.mtgp_name
+
+        # Resolved on a previous run?
+        code = index.get_code(card.set, card.num, name)
+        if not code:
+            try:
+                # Possible promo set
+                if card.promo or card.mtgp_set == "pmo":
+                    code = core.match_mtgp_code_pmo(
+                        await self.get_promo_checklist(card.mtgp_set),
+                        name,
+                        card.artist,
+                        card.set_name,
+                    )
+
+                # Try looking for the card under its collector number
+                if not code:
+                    code = core.match_mtgp_code(
+                        await self.get_checklist(card.mtgp_set), card.num, name
+                    )
+            except net.TransientError as e:
+                # Guess the code rather than failing the card, don't index it
+                card.skip_mtgp(e)
+                code = None
+            else:
+                if code:
+                    index.set_code(card.set, card.num, name, code)
+        card.code = code or card.set + card.num
+        return card.code
+
+    async def get_checklist(self, set_code: str) -> Optional[dict]:
+        """
+        Retrieve the parsed MTG Pics checklist for a set, scraped only once per run.
+        :param set_code: MTGP set code, ex: mh2
+        :return: Dict of checklist rows and (number, name) index, None if not found
+        """
+        return await self.get_cached_checklist(
+            set_code, self.fetch_mtgp_checklist, set_code
+        )
+
+    async def get_promo_checklist(self, promo: str) -> Optional[dict]:
+        """
+        Retrieve the parsed MTG Pics checklist for a promo set, scraped only once per run.
+        :param promo: Promo set type, ex: pmo, dci, a22, uni
+        :return: Dict of checklist rows, (number, name) index and artist index
+        """
+        url = core.get_promo_checklist_url(promo)
+        return await self.get_cached_checklist(url, self.fetch_promo_checklist, url)
+
+    async def get_cached_checklist(
+        self, key: str, func: Callable, *args
+    ) -> Optional[dict]:
+        """
+        Return a cached checklist, fetching it if this is the first request for it.
+        Tasks asking for the same checklist wait on the first fetch.
+        :param key: Key to cache the checklist under, shared with the threads engine
+        :param func: Coroutine function that fetches and parses the checklist
+        :return: Parsed checklist, None if it couldn't be retrieved
+        """
+        if key not in core.checklists:
+            try:
+                checklist = await self.coalesce(("CHECKLIST", key), func, *args)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return None
+            core.checklists[key] = checklist
+        return core.checklists[key]
+
+    async def fetch_mtgp_checklist(self, set_code: str) -> Optional[dict]:
+        """
+        Webscrape the MTG Pics checklist for a given set.
+        :param set_code: MTGP set code, ex: mh2
+        :return: Parsed checklist, None if it couldn't be retrieved
+        """
+        # Crawl the mtgpics site to find correct set code
+        content = await self.get(f"https://www.mtgpics.com/card?ref={set_code}001")
+        link = await self.parse(mtgpics.parse_set_link, content)
+        if not link:
+            return None
+        replaced = link.replace("set?", "set_checklist?")
+        return await self.fetch_checklist(f"https://mtgpics.com/{replaced}")
+
+    async def fetch_checklist(self, url: str) -> dict:
+        """
+        Webscrape an MTG Pics checklist page and index its rows.
+        :param url: URL of the set checklist page
+        :return: Dict of checklist rows and (number, name) index
+        """
+        rows = await self.parse(mtgpics.parse_checklist, await self.get(url))
+        return core.index_checklist(rows)
+
+    async def fetch_promo_checklist(self, url: str) -> Optional[dict]:
+        """
+        Webscrape an MTG Pics promo checklist page and index its rows by artist.
+        :param url: URL of the promo checklist page
+        :return: Dict of checklist rows, (number, name) index and artist index
+        """
+        return core.index_promo_checklist(await self.fetch_checklist(url))
+
+    @staticmethod
+    async def parse(func: Callable, content: bytes):
+        """
+        Parse an MTG Pics page off the event loop, in the process pool if enabled.
+        :param func: Parser from the mtgpics module
+        :param content: Page content
+        :return: Whatever the parser returns
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(mtgpics.get_executor(), func, content)
+
+    async def get_faces(self, card) -> tuple:
+        """
+        Scrape the MTG Pics card page once, picking out the image for each face.
+        :param card: Card object
+        :return: Tuple of front and back image links, None where a face has no image
+        """
+        if card.faces is not None:
+            return card.faces
+
+        # Resolving the code scrapes the set checklist, once per set
+        if card.code is None:
+            await self.resolve_code(card)
+
+        # Scraped on a previous run?
+        images = index.get_images(card.code)
+        if images is None:
+            try:
+                content = await self.get(
+                    f"https://www.mtgpics.com/card?ref={card.code}"
+                )
+            except net.TransientError as e:
+                card.skip_mtgp(e)
+                card.faces = (None, None)
+                return card.faces
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                card.faces = (None, None)
+                return card.faces
+            images = await self.parse(mtgpics.parse_card_images, content)
+            if images:
+                index.set_images(card.set, card.code, images)
+        card.faces = core.get_card_faces([{"src": src} for src in images])
+        return card.faces
+
+    async def download_scryfall(
+        self, card, name: str, path: str, scrylink: str, back: bool = False
+    ) -> bool:
+        """
+        Download scryfall art crop.
+        :param card: Card object
+        :param name: Name of card to use in console output
+        :param path: Image save path
+        :param scrylink: Art crop scryfall URI
+        :param back: Is this the back side?
+        :return: True if successful
+        """
+        if not scrylink:
+            return False
+        path = f"{cfg.scry}/{path}"
+        try:
+            info = await self.download_file(scrylink, path)
+        except net.TransientError as e:
+            card.error = str(e)
+            return False
+        if not info:
+            return False
+        manifest.add(
+            card.id, "back" if back else "front", "scryfall", scrylink, path, info
+        )
+        console.out.append(
+            f"{Fore.YELLOW}SCRYFALL:{Style.RESET_ALL} {name} [{card.set.upper()}]"
+        )
+        return True
@@ -0,0 +1,256 @@
+"""
+OFFLINE SCRYFALL BULK DATA
+"""
+import os
+import json
+import sqlite3
+from difflib import get_close_matches
+from threading import Lock
+from typing import Iterator, Optional
+from unidecode import unidecode
+from lib import settings as cfg
+from lib.constants import console
+
+# Card fields needed to download a card
+CARD_KEYS = [
+    "id",
+    "oracle_id",
+    "name",
+    "set",
+    "set_name",
+    "set_type",
+    "collector_number",
+    "artist",
+    "layout",
+    "type_line",
+    "keywords",
+    "full_art",
+    "illustration_id",
+    "released_at",
+]
+FACE_KEYS = ["name", "artist", "type_line", "illustration_id"]
+
+# Layouts Scryfall treats as extras
+EXTRA_LAYOUTS = [
+    "token",
+    "double_faced_token",
+    "emblem",
+    "art_series",
+    "vanguard",
+    "scheme",
+    "planar",
+]
+
+
+def iter_json_array(path: str, chunk_size: int = 1 << 20) -> Iterator[dict]:
+    """
+    Stream each object from a JSON array file without loading the whole file.
+    :param path: Path to the JSON file
+    :param chunk_size: Characters to read at a time
+    :return: Iterator of the objects in the array
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf, pos = "", 0
+        while True:
+            chunk = f.read(chunk_size)
+            buf, pos = buf[pos:] + chunk, 0
+            while True:
+                # Skip separators between objects
+                while pos < len(buf) and buf[pos] in " \t\r\n,[]":
+                    pos += 1
+                if pos == len(buf):
+                    break
+                try:
+                    obj, pos = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    # Object continues in the next chunk
+                    if not chunk:
+                        raise
+                    break
+                yield obj
+            if not chunk:
+                return
+
+
+def compact_card(c: dict) -> dict:
+    """
+    Strip card data down to the fields needed to download it.
+    :param c: Full Scryfall card data
+    :return: Compact card data
+    """
+    card = {k: c[k] for k in CARD_KEYS if k in c}
+    if "image_uris" in c:
+        card["image_uris"] = {"art_crop": c["image_uris"].get("art_crop")}
+    if "card_faces" in c:
+        card["card_faces"] = []
+        for face in c["card_faces"]:
+            f = {k: face[k] for k in FACE_KEYS if k in face}
+            if "image_uris" in face:
+                f["image_uris"] = {"art_crop": face["image_uris"].get("art_crop")}
+            card["card_faces"].append(f)
+    return card
+
+
+def normalize(name: str) -> str:
+    """
+    Normalize a card name for lookups.
+    :param name: Card name
+    :return: Lowercase ascii card name
+    """
+    return unidecode(name).lower().strip()
+
+
+class BulkData:
+    """
+    Indexed store of a Scryfall bulk data file, answering card lookups offline.
+    """
+
+    def __init__(self, source: str, path: str):
+        self.source = source
+        self.path = path
+        self.conn: Optional[sqlite3.Connection] = None
+        self.names: list = []
+        self.lock = Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Open the store, rebuilding it if the bulk data file has changed.
+        """
+        with self.lock:
+            if not self.conn:
+                conn = sqlite3.connect(self.path, check_same_thread=False)
+                conn.executescript(
+                    "CREATE TABLE IF NOT EXISTS meta (source TEXT, mtime REAL, size INT);"
+                    "CREATE TABLE IF NOT EXISTS cards ("
+                    "id TEXT PRIMARY KEY, oracle_id TEXT, set_code TEXT, num TEXT, "
+                    "released TEXT, data TEXT);"
+                    "CREATE TABLE IF NOT EXISTS names (name TEXT, id TEXT);"
+                    "CREATE INDEX IF NOT EXISTS names_name ON names (name);"
+                    "CREATE INDEX IF NOT EXISTS cards_set ON cards (set_code, num);"
+                    "CREATE INDEX IF NOT EXISTS cards_oracle ON cards (oracle_id);"
+                )
+                stat = os.stat(self.source)
+                meta = (self.source, stat.st_mtime, stat.st_size)
+                if conn.execute("SELECT * FROM meta").fetchone() != meta:
+                    self.build(conn, meta)
+                self.names = [
+                    r[0] for r in conn.execute("SELECT DISTINCT name FROM names")
+                ]
+                self.conn = conn
+            return self.conn
+
+    def build(self, conn: sqlite3.Connection, meta: tuple) -> None:
+        """
+        Stream the bulk data file into the store.
+        :param conn: Store connection
+        :param meta: Source path, modified time and size of the bulk data file
+        """
+        console.alert("Indexing Scryfall bulk data, this may take a minute...")
+        conn.executescript("DELETE FROM meta; DELETE FROM cards; DELETE FROM names;")
+        cards, names = [], []
+        for c in iter_json_array(self.source):
+            card = compact_card(c)
+            cards.append(
+                (
+                    card["id"],
+                    card.get("oracle_id"),
+                    card["set"],
+                    card["collector_number"],
+                    card.get("released_at", ""),
+                    json.dumps(card),
+                )
+            )
+            # Index the full name and each face name
+            faces = {card["name"]}
+            faces.update(f["name"] for f in card.get("card_faces", []))
+            names.extend((normalize(n), card["id"]) for n in faces)
+            if len(cards) >= 1000:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO cards VALUES (?,?,?,?,?,?)", cards
+                )
+                conn.executemany("INSERT INTO names VALUES (?,?)", names)
+                cards, names = [], []
+        conn.executemany("INSERT OR REPLACE INTO cards VALUES (?,?,?,?,?,?)", cards)
+        conn.executemany("INSERT INTO names VALUES (?,?)", names)
+        conn.execute("INSERT INTO meta VALUES (?,?,?)", meta)
+        conn.commit()
+
+    def find(self, name: str, set_code: Optional[str] = None) -> list:
+        """
+        Find every print with this exact card or face name, newest first.
+        :param name: Card name
+        :param set_code: Only return prints from this set
+        :return: List of card data
+        """
+        conn = self.connect()
+        query = (
+            "SELECT DISTINCT cards.data FROM names JOIN cards ON names.id = cards.id "
+            "WHERE names.name = ?"
+        )
+        params = [normalize(name)]
+        if set_code:
+            query += " AND cards.set_code = ?"
+            params.append(set_code.lower())
+        with self.lock:
+            rows = conn.execute(query + " ORDER BY cards.released DESC", params)
+            return [json.loads(r[0]) for r in rows]
+
+    def search(self, name: str) -> list:
+        """
+        Exact name search, following the unique and extras search settings.
+        :param name: Card name
+        :return: List of card data, newest first
+        """
+        cards, seen = [], set()
+        for c in self.find(name):
+            if cfg.include_extras != "True" and (
+                c["layout"] in EXTRA_LAYOUTS or c["set_type"] == "memorabilia"
+            ):
+                continue
+            if cfg.unique == "art":
+                faces = c.get("card_faces", [{}])
+                art = c.get("illustration_id") or faces[0].get("illustration_id")
+                if art in seen:
+                    continue
+                seen.add(art or c["id"])
+            cards.append(c)
+        return cards
+
+    def named(self, name: str, set_code: Optional[str] = None) -> Optional[dict]:
+        """
+        Fuzzy name lookup, returning the newest matching print.
+        :param name: Card name, can be partial or misspelled
+        :param set_code: Only return prints from this set
+        :return: Card data, None if no card matched
+        """
+        cards = self.find(name, set_code)
+        if cards:
+            return cards[0]
+
+        # Try names starting with this name, then similar names
+        self.connect()
+        norm = normalize(name)
+        candidates = [n for n in self.names if n.startswith(norm)]
+        candidates.extend(get_close_matches(norm, self.names, n=3, cutoff=0.75))
+        for candidate in candidates:
+            cards = self.find(candidate, set_code)
+            if cards:
+                return cards[0]
+        return None
+
+    def collection(self, identifiers: list) -> list:
+        """
+        Exact lookup for a batch of name and set identifiers.
+        :param identifiers: List of Scryfall identifiers containing name and set
+        :return: List of card data for each identifier that was found
+        """
+        cards = []
+        for i in identifiers:
+            found = self.find(i["name"], i.get("set"))
+            if found:
+                cards.append(found[0])
+        return cards
+
+
+bulk = BulkData(cfg.bulk_data, os.path.join(cfg.folder, "scryfall_bulk.sqlite3"))
@@ -2,20 +2,31 @@
 CARD CLASSES
 """
 import os
-from urllib.error import HTTPError, ContentTooShortError
+from typing import Optional
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+from requests import RequestException
 from pathvalidate import sanitize_filename
-import requests
 from pathlib import Path
-from urllib import request
-from bs4 import BeautifulSoup
 from colorama import Style, Fore
 from unidecode import unidecode
 from lib import settings as cfg
 from lib.constants import console
+from lib.index import index
+from lib.manifest import manifest
 from lib import core
+from lib import net
+from lib import mtgpics
 
 cwd = os.getcwd()
 
+# Threads downloading back faces alongside their fronts
+back_faces = ThreadPoolExecutor(max_workers=cfg.download_workers)
+
+# Image paths claimed by downloads in progress, so prints sharing a name never share a file
+claimed: set = set()
+claimed_lock = Lock()
+
 
 # SINGLE IMAGE CARDS
 class Card:
@@ -28,6 +39,18 @@ class Card:
 
     def __init__(self, c: dict) -> None:
         # Inherited card info
+        self.id = c["id"]
+        self.images: dict = {}
+        # Front and back image links, scraped once for both faces
+        self.faces: Optional[tuple] = None
+        self.lock = Lock()
+        # Last transient error, logged if the card fails
+        self.error: Optional[str] = None
+        # Fall back on Scryfall if MTGP fails?
+        self.fallback = cfg.download_scryfall
+        # Defer the card to a later MTGP pass if MTGP is unavailable?
+        self.defer = True
+        self.deferred = False
         self.set = c["set"]
         self.artist = unidecode(c["artist"])
         self.num = c["collector_number"]
@@ -48,35 +71,60 @@ class Card:
         if not hasattr(self, "name"):
             self.name = c["name"]
 
-        # Possible promo card?
-        self.promo = self.check_for_promo()
-
-        # Get the MTGP code
-        self.code = self.get_mtgp_code(self.name)
+        # MTGP code, resolved when MTGP is first needed
+        self.promo = False
+        self.code: Optional[str] = None
 
         # Make folders, setup path
         if self.path:
             self.make_folders()
         self.make_path()
 
+    def resolve_code(self) -> str:
+        """
+        Get the MTGP code, scraping MTG Pics the first time it's needed.
+        :return: MTGP linkage
+        """
+        if self.code is None:
+            # Possible promo card?
+            self.promo = self.check_for_promo()
+            self.code = self.get_mtgp_code(self.mtgp_name)
+        return self.code
+
+    @property
+    def mtgp_name(self) -> str:
+        """
+        Name this card is listed under on MTG Pics.
+        :return: Card name as MTG Pics displays it
+        """
+        return self.name
+
     def get_mtgp_code(self, name: str) -> str:
         """
         Get the correct mtgp URL code
         """
-        # Possible promo set
-        if self.promo or self.mtgp_set == "pmo":
-            code = core.get_mtgp_code_pmo(
-                name, self.artist, self.set_name, self.mtgp_set
-            )
-            if code:
-                return code
-
-        # Try looking for the card under its collector number
-        code = core.get_mtgp_code(self.mtgp_set, self.num, name)
+        # Resolved on a previous run?
+        code = index.get_code(self.set, self.num, name)
         if code:
             return code
-        else:
+        try:
+            # Possible promo set
+            if self.promo or self.mtgp_set == "pmo":
+                code = core.get_mtgp_code_pmo(
+                    name, self.artist, self.set_name, self.mtgp_set
+                )
+
+            # Try looking for the card under its collector number
+            if not code:
+                code = core.get_mtgp_code(self.mtgp_set, self.num, name)
+        except net.TransientError as e:
+            # Guess the code rather than failing the card, don't index it
+            self.skip_mtgp(e)
             return self.set + self.num
+        if code:
+            index.set_code(self.set, self.num, name, code)
+            return code
+        return self.set + self.num
 
     def download(self, log_failed: bool = True) -> bool:
         """
@@ -84,77 +132,128 @@ class Card:
         """
         # Download only scryfall?
         if cfg.only_scryfall:
-            if not self.download_scryfall(self.name, self.filename, self.scrylink):
-                return False
+            return self.download_scryfall(self.name, self.filename, self.scrylink)
 
         # Try downloading MTGP
-        if not self.download_mtgp(self.name, self.filename, self.code):
-            if cfg.download_scryfall:
+        if not self.download_mtgp(self.name, self.filename):
+            if self.fallback:
                 self.download_scryfall(self.name, self.filename, self.scrylink)
-            if log_failed:
-                core.log(self.name, self.set)
+            if log_failed and not self.deferred:
+                core.log(self.name, self.set, card_id=self.id, reason=self.error)
             return False
         return True
 
-    def download_mtgp(self, name: str, path: str, mtgp_code: str, back: bool = False):
+    def download_mtgp(self, name: str, path: str, back: bool = False):
         """
         Download image from MTG Pics
         :param name: Name of card to use for console output
         :param path: Image save path
-        :param mtgp_code: MTGP linkage
         :param back: Is this the back side?
         :return:
         """
-        img_link = ""
         path = f"{cfg.mtgp}/{path}"
         try:
-            # Crawl the mtgpics site to find correct link
-            r = requests.get("https://www.mtgpics.com/card?ref=" + mtgp_code)
-            soup = BeautifulSoup(r.content, "html.parser")
-            soup_img = soup.find_all(
-                "img", {"style": "display:block;border:4px black solid;cursor:pointer;"}
-            )
-
             # Is this the back face?
-            img_link = core.get_card_face(soup_img, back)
-
-            # Check path for overwrites
-            if not cfg.overwrite:
-                path = self.check_path(path)
+            img_link = self.get_mtgp_faces()[1 if back else 0]
+        except net.TransientError as e:
+            self.skip_mtgp(e)
+            return False
+        except (TypeError, AttributeError, RequestException, OSError):
+            return False
+        if not img_link:
+            return False
 
+        # Check path for overwrites, only a path claimed here is released
+        claimed_path = None
+        if not cfg.overwrite:
+            path = claimed_path = self.check_path(path)
+        try:
             # Try to download from MTG Pics
-            request.urlretrieve(img_link, path)
+            info = net.download(img_link, path)
             console.out.append(
                 f"{Fore.GREEN}MTGP:{Style.RESET_ALL} {name} [{self.set.upper()}]"
             )
-        except ContentTooShortError:
-            # Retry download
-            try:
-                request.urlretrieve(img_link, path)
-                console.out.append(
-                    f"{Fore.GREEN}MTGP:{Style.RESET_ALL} {name} [{self.set.upper()}]"
-                )
-            except (TypeError, AttributeError, HTTPError, ContentTooShortError):
-                return False
-        except (TypeError, AttributeError, HTTPError):
+        except net.TransientError as e:
+            self.skip_mtgp(e)
+            return False
+        except (TypeError, AttributeError, RequestException, OSError):
             return False
+        finally:
+            if claimed_path:
+                self.release_path(claimed_path)
+        manifest.add(self.id, "back" if back else "front", "mtgp", img_link, path, info)
         return True
 
-    def download_scryfall(self, name: str, path: str, scrylink: str):
+    def skip_mtgp(self, error: net.TransientError) -> None:
+        """
+        Record why MTG Pics failed, deferring the card if MTG Pics is unavailable.
+        :param error: Error that outlasted its retries
+        """
+        self.error = str(error)
+        if self.defer and isinstance(error, net.CircuitOpen):
+            self.deferred = True
+
+    def get_mtgp_faces(self) -> tuple:
+        """
+        Scrape the MTG Pics card page once, picking out the image for each face.
+        :return: Tuple of front and back image links, None where a face has no image
+        """
+        # Both faces may ask at once, only one of them scrapes
+        with self.lock:
+            if self.faces is None:
+                try:
+                    images = self.get_mtgp_images(self.resolve_code())
+                except net.TransientError:
+                    # Don't make the other face wait out the retries again
+                    self.faces = (None, None)
+                    raise
+                self.faces = core.get_card_faces(images)
+            return self.faces
+
+    def get_mtgp_images(self, mtgp_code: str) -> list:
+        """
+        Get the art images listed on the MTG Pics card page.
+        :param mtgp_code: MTGP linkage
+        :return: List of image entries containing their src
+        """
+        # Already scraped for this card, or on a previous run?
+        images = self.images.get(mtgp_code)
+        if images is None:
+            images = index.get_images(mtgp_code)
+        if images is None:
+            # Crawl the mtgpics site to find correct link
+            r = net.get("https://www.mtgpics.com/card?ref=" + mtgp_code)
+            images = mtgpics.offload(mtgpics.parse_card_images, r.content)
+            if images:
+                index.set_images(self.set, mtgp_code, images)
+        self.images[mtgp_code] = images
+        return [{"src": src} for src in images]
+
+    def download_scryfall(
+        self, name: str, path: str, scrylink: str, back: bool = False
+    ):
         """
         Download scryfall art crop
         :param name: Name of card to use in console output
         :param path: Image save path
         :param scrylink: Art crop scryfall URI
+        :param back: Is this the back side?
         :return:
         """
+        path = f"{cfg.scry}/{path}"
         try:
-            request.urlretrieve(scrylink, f"{cfg.scry}/{path}")
+            info = net.download(scrylink, path)
+            manifest.add(
+                self.id, "back" if back else "front", "scryfall", scrylink, path, info
+            )
             console.out.append(
                 f"{Fore.YELLOW}SCRYFALL:{Style.RESET_ALL} {name} [{self.set.upper()}]"
             )
             return True
-        except (TypeError, AttributeError, HTTPError):
+        except net.TransientError as e:
+            self.error = str(e)
+            return False
+        except (TypeError, AttributeError, RequestException):
             return False
 
     def make_folders(self):
@@ -195,19 +294,24 @@ class Card:
     @staticmethod
     def check_path(path):
         """
-        Check if path needs to be numbered to prevent overwrite.
+        Claim the path, numbering it to prevent overwrite.
+        Prints with the same name downloading at once each claim their own number.
         """
-        # Front face
-        if Path(path).is_file():
-            i = 1
-            path = path.replace(".jpg", f" ({str(i)}).jpg")
-            while True:
+        with claimed_lock:
+            numbered, i = path, 0
+            while numbered in claimed or Path(numbered).is_file():
                 i += 1
-                if Path(path).is_file():
-                    path = path.replace(f"({str(i-1)})", f"({str(i)})")
-                else:
-                    break
-        return path
+                numbered = path.replace(".jpg", f" ({i}).jpg")
+            claimed.add(numbered)
+            return numbered
+
+    @staticmethod
+    def release_path(path):
+        """
+        Release a path claimed for a download, once the file is in place or failed.
+        """
+        with claimed_lock:
+            claimed.discard(path)
 
     def check_for_promo(self):
         """
@@ -272,14 +376,13 @@ class Adventure(Card):
         self.savename = c["card_faces"][0]["name"]
         super().__init__(c)
 
-    def get_mtgp_code(self, name: str):
+    @property
+    def mtgp_name(self) -> str:
         """
-        Override this method because flip names are displayed differently.
-        :param name: Card name to reformat
-        :return: The MTGP code linkage
+        Override this property because flip names are displayed differently.
+        :return: Card name as MTG Pics displays it
         """
-        name = self.name.replace("//", "/")
-        return super().get_mtgp_code(name)
+        return self.name.replace("//", "/")
 
     def make_path(self):
         """
@@ -334,14 +437,13 @@ class Flip(Card):
         self.savename = c["card_faces"][0]["name"]
         super().__init__(c)
 
-    def get_mtgp_code(self, name: str):
+    @property
+    def mtgp_name(self) -> str:
         """
-        Override this method because flip names are displayed differently.
-        :param name: Card name to reformat
-        :return: The MTGP code linkage
+        Override this property because flip names are displayed differently.
+        :return: Card name as MTG Pics displays it
         """
-        name = self.name.replace("//", "/")
-        return super().get_mtgp_code(name)
+        return self.name.replace("//", "/")
 
     def make_path(self):
         """
@@ -386,38 +488,39 @@ class MDFC(Card):
         :param log_failed: Whether to log failed download attempts.
         :return:
         """
-        # Call super to download the front
-        front = super().download()
-        back = False
-
-        # Download the back.
-        if cfg.only_scryfall:
-            if self.download_scryfall(
-                self.name_back, self.filename_back, self.scrylink_back
-            ):
-                back = True
-        else:
-            if not self.download_mtgp(
-                f"{self.name_back} (Back)", self.filename_back, self.code, True
-            ):
-                if cfg.download_scryfall:
-                    self.download_scryfall(
-                        self.name_back, self.filename_back, self.scrylink_back
-                    )
-            else:
-                back = True
+        # Download the back alongside the front, failures are logged below
+        future = back_faces.submit(self.download_back)
+        front = super().download(False)
+        back = future.result()
 
         # Log any failures
-        if log_failed:
+        if log_failed and not self.deferred:
             if not front and not back:
-                core.log(self.name, self.set)
+                core.log(self.name, self.set, card_id=self.id, reason=self.error)
                 return False
             elif not front:
-                core.log(self.name, self.set, "failed_front")
+                core.log(self.name, self.set, "failed_front", self.id, self.error)
             elif not back:
-                core.log(self.name_back, self.set, "failed_back")
+                core.log(self.name_back, self.set, "failed_back", self.id, self.error)
         return True
 
+    def download_back(self) -> bool:
+        """
+        Download the back side.
+        :return: True if successful
+        """
+        if cfg.only_scryfall:
+            return self.download_scryfall(
+                self.name_back, self.filename_back, self.scrylink_back, True
+            )
+        if self.download_mtgp(f"{self.name_back} (Back)", self.filename_back, True):
+            return True
+        if self.fallback:
+            self.download_scryfall(
+                self.name_back, self.filename_back, self.scrylink_back, True
+            )
+        return False
+
 
 class Transform(MDFC):
     """
@@ -441,14 +544,13 @@ class Split(MDFC):
         self.scrylink = c["image_uris"]["art_crop"]
         super().__init__(c)
 
-    def get_mtgp_code(self, name: str):
+    @property
+    def mtgp_name(self) -> str:
         """
-        Override this method because split names are displayed differently.
-        :param name: Card name to reformat
-        :return: The MTGP code linkage
+        Override this property because split names are displayed differently.
+        :return: Card name as MTG Pics displays it
         """
-        name = self.fullname.replace("//", "/")
-        return super().get_mtgp_code(name)
+        return self.fullname.replace("//", "/")
 
 
 class Meld(Card):
@@ -508,3 +610,31 @@ def get_card_class(c: dict):
     if "type_line" in c and "Land" in c["type_line"] and "card_faces" not in c:
         return Land
     return class_map[c["layout"]]
+
+
+def is_downloaded(c: dict, card_class) -> bool:
+    """
+    Check the manifest to see if this card can be skipped.
+    :param c: Card json data.
+    :param card_class: Card class used to download this card.
+    :return: True if skipping downloaded cards and every face was downloaded.
+    """
+    if not cfg.skip_downloaded:
+        return False
+    faces = 2 if issubclass(card_class, MDFC) else 1
+    if not manifest.is_complete(c["id"], faces):
+        return False
+    console.out.append(f"{Fore.CYAN}SKIPPED:{Style.RESET_ALL} {c['name']}")
+    return True
+
+
+def download_card(c: dict) -> bool:
+    """
+    Download a card, unless it was already downloaded.
+    :param c: Card json data.
+    :return: True if the card downloaded or was skipped.
+    """
+    card_class = get_card_class(c)
+    if is_downloaded(c, card_class):
+        return True
+    return card_class(c).download()
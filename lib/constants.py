@@ -1,38 +1,132 @@
 """
 GLOBAL CONSTANTS
 """
-import time
+import sys
+from queue import Queue, Empty
 from threading import Thread, Lock
+from typing import Optional
+from lib import settings as cfg
 
 LOCK = Lock()
 
+# Most messages written to the terminal at once
+BATCH_SIZE = 200
+# Width of the progress bar in characters
+BAR_WIDTH = 30
+
+
+class Messages(Queue):
+    """
+    Queue of messages waiting to be written, appended to like a list.
+    """
+
+    def append(self, msg: Optional[str], alert: bool = False) -> None:
+        """
+        Add a message to be written.
+        :param msg: Message to write, None only redraws the progress bar
+        :param alert: Write even in quiet and progress modes
+        """
+        self.put((msg, alert))
+
 
 class Console:
-    def __init__(self):
-        self.out = []
+    """
+    Writes messages from every download thread in batches, so output never holds them up.
+    Quiet mode hides card messages, progress mode replaces them with a progress bar.
+    """
 
-    def wait(self):
+    def __init__(self, mode: str = "normal"):
+        self.out = Messages()
+        self.mode = mode
+        self.total: Optional[int] = None
+        self.done = 0
+        self.bar = ""
+
+    def alert(self, msg: str) -> None:
         """
-        Repeatedly check if new print messages have been added and output them.
+        Add a message that's written in every mode, like failures and errors.
+        :param msg: Message to write
         """
-        while True:
-            with LOCK:
-                if len(self.out) > 0:
-                    msg = self.out.pop(0)
-                    print(msg)
-                    time.sleep(0.05)
-            time.sleep(0.01)
+        self.out.append(msg, True)
+
+    def start(self, total: Optional[int]) -> None:
+        """
+        Reset the progress bar for a new card list.
+        :param total: Number of cards in the list, None if unknown
+        """
+        with LOCK:
+            self.total, self.done = total, 0
 
-    def flush(self):
+    def tick(self, count: int = 1) -> None:
         """
-        Return only when all messages have flushed.
+        Mark cards from the list as finished, updating the progress bar.
+        :param count: Number of cards finished
+        """
+        with LOCK:
+            self.done += count
+        if self.mode == "progress":
+            self.out.append(None)
+
+    def wait(self) -> None:
+        """
+        Wait for new messages and write them, along with any others already waiting.
         """
         while True:
-            time.sleep(0.1)
-            if len(self.out) == 0:
-                time.sleep(0.1)
-                return
+            batch = [self.out.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.out.get_nowait())
+                except Empty:
+                    break
+            try:
+                self.write(batch)
+            finally:
+                for _ in batch:
+                    self.out.task_done()
+
+    def write(self, batch: list) -> None:
+        """
+        Write a batch of messages, then redraw the progress bar below them.
+        :param batch: List of messages and whether each is an alert
+        """
+        lines = [
+            msg
+            for msg, alert in batch
+            if msg is not None and (alert or self.mode == "normal")
+        ]
+        text = "".join(f"{line}\n" for line in lines)
+        if self.mode == "progress":
+            # Clear the old bar before writing over it
+            text = "\r" + " " * len(self.bar) + "\r" + text
+            self.bar = self.get_bar()
+            text += self.bar
+        if text:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+
+    def get_bar(self) -> str:
+        """
+        Progress bar for the current card list.
+        :return: Bar showing finished cards out of the total
+        """
+        with LOCK:
+            done, total = self.done, self.total
+        if not total:
+            return f"{done} cards finished"
+        filled = min(BAR_WIDTH, BAR_WIDTH * done // total)
+        return f"[{'#' * filled}{'.' * (BAR_WIDTH - filled)}] {done}/{total} cards"
+
+    def flush(self) -> None:
+        """
+        Return only when all messages have been written.
+        """
+        self.out.join()
+        if self.bar:
+            # Keep the finished bar on its own line
+            sys.stdout.write("\n")
+            sys.stdout.flush()
+            self.bar = ""
 
 
-console = Console()
+console = Console(cfg.console_mode)
 Thread(target=console.wait, daemon=True).start()
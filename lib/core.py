@@ -2,15 +2,24 @@
 CORE FUNCTIONS
 """
 import os
-from typing import Optional
-from urllib.parse import quote_plus
-import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from threading import Lock
+from typing import Optional, Callable, Iterator
+from urllib.parse import quote, quote_plus, urlparse, urlunparse, parse_qs, urlencode
 from difflib import SequenceMatcher
 from pathlib import Path
 from colorama import Style, Fore
-from bs4 import BeautifulSoup
-from unidecode import unidecode
+from requests import RequestException
 from lib import settings as cfg
+from lib import net
+from lib import mtgpics
+from lib.bulk import bulk, normalize
+from lib.sets import sets
+from lib.constants import console
+from lib.failures import failures
+from lib.httpcache import cache
 
 cwd = os.getcwd()
 # Add necessary directories
@@ -20,6 +29,17 @@ Path(cfg.scry).mkdir(mode=511, parents=True, exist_ok=True)
 Path(os.path.join(cwd, "logs")).mkdir(mode=511, parents=True, exist_ok=True)
 Path(os.path.join(cwd, "lists")).mkdir(mode=511, parents=True, exist_ok=True)
 
+# Scryfall endpoint for looking up cards in batches
+collection_url = "https://api.scryfall.com/cards/collection"
+
+# MTGP set ID of each promo checklist
+promo_sets = {"pmo": 72, "dci": 18, "a22": 375, "uni": 201}
+
+# Parsed MTGP checklists, cached for the duration of a run
+checklists: dict = {}
+checklist_locks: dict = {}
+checklist_lock = Lock()
+
 
 def get_command(command: str) -> Optional[dict]:
     """
@@ -39,7 +59,7 @@ def get_list_from_link(command: dict) -> str:
     :param command: Command array including name, and url
     :return: Filename of the newly created list
     """
-    cards = requests.get(command["url"]).json()
+    cards = net.get(command["url"]).json()
     with open(
         os.path.join(cwd, f"lists/{command['name']}.txt"), "w", encoding="utf-8"
     ) as f:
@@ -54,11 +74,11 @@ def get_list_from_link(command: dict) -> str:
     return os.path.join(cwd, f"lists/{command['name']}.txt")
 
 
-def get_list_from_scryfall(com: str) -> Optional[list]:
+def get_list_from_scryfall(com: str) -> Optional["CardPages"]:
     """
     Use Scryfall API compliant query to return a list.
     :param com: Command string containing scryfall arguments.
-    :return: Return path to the list file
+    :return: Cards matching the query, None if the query failed
     """
     command = {}
     query = "https://api.scryfall.com/cards/search?q="
@@ -87,7 +107,8 @@ def get_list_from_scryfall(com: str) -> Optional[list]:
             pass
         command.update({arg[0] + sep: arg[1]})
         if "set:" in command and "is:" not in command:
-            if get_mtg_set(command["set:"])["set_type"] == "expansion":
+            mtg_set = get_mtg_set(command["set:"])
+            if mtg_set and mtg_set["set_type"] == "expansion":
                 command.update({"is:": "booster"})
 
     # Add each argument to scryfall search
@@ -95,132 +116,341 @@ def get_list_from_scryfall(com: str) -> Optional[list]:
         query += quote_plus(f" {k}{v}")
     query += "&unique=art"
 
-    # Query scryfall
-    res = requests.get(query).json()
-
-    # Add additional pages if any exist
-    cards = []
-    try:
-        while True:
-            cards.extend(res["data"])
-            if res["has_more"]:
-                res = requests.get(res["next_page"]).json()
-            else:
-                break
-    except KeyError:
+    # Query scryfall, remaining pages are fetched as the list is read
+    res = net.get(query).json()
+    if "data" not in res:
         return None
+    return CardPages(res)
 
-    # Write the list
-    return cards
+
+class CardPages:
+    """
+    Cards returned by a Scryfall search, fetching the remaining pages ahead in
+    parallel while earlier cards are being downloaded.
+    """
+
+    def __init__(self, first: dict):
+        self.first = first
+        self.total = first.get("total_cards", len(first["data"]))
+        # Pages that couldn't be fetched
+        self.missing: list = []
+
+    def __len__(self) -> int:
+        return self.total
+
+    def __iter__(self) -> Iterator[dict]:
+        yield from self.first["data"]
+        if not self.first.get("has_more"):
+            return
+
+        # Total unknown, follow each page in turn
+        per_page = len(self.first["data"])
+        if "total_cards" not in self.first or not per_page:
+            res, page = self.first, 1
+            while res.get("has_more"):
+                page += 1
+                try:
+                    res = net.get(res["next_page"]).json()
+                except (RequestException, ValueError) as e:
+                    # Later pages are only linked from this one
+                    self.skip_page(page, e)
+                    return
+                yield from res.get("data", [])
+            return
+
+        # Fetch pages ahead, handing over each page's cards in order
+        pages = iter(range(2, -(-self.total // per_page) + 1))
+        with ThreadPoolExecutor(max_workers=cfg.page_workers) as pool:
+            ahead: deque = deque()
+            for page in islice(pages, cfg.page_workers):
+                ahead.append((page, pool.submit(self.get_page, page)))
+            while ahead:
+                page, future = ahead.popleft()
+                for p in islice(pages, 1):
+                    ahead.append((p, pool.submit(self.get_page, p)))
+                try:
+                    res = future.result()
+                except (RequestException, ValueError) as e:
+                    # Skip the page, the cards on other pages still download
+                    count = min(per_page, self.total - (page - 1) * per_page)
+                    self.skip_page(page, e, count)
+                    continue
+                yield from res.get("data", [])
+
+    def skip_page(self, page: int, error: Exception, count: int = 0) -> None:
+        """
+        Report a page of search results that couldn't be fetched.
+        :param page: Page number
+        :param error: Error that outlasted its retries
+        :param count: Cards on the page, counted as finished
+        """
+        self.missing.append(page)
+        console.alert(
+            f"{Fore.RED}UNAVAILABLE:{Style.RESET_ALL} "
+            f"Scryfall search page {page} ({error})"
+        )
+        if count:
+            console.tick(count)
+
+    def get_page(self, page: int) -> dict:
+        """
+        Fetch a page of search results.
+        :param page: Page number
+        :return: Json data of the page
+        """
+        url = urlparse(self.first["next_page"])
+        query = parse_qs(url.query)
+        query["page"] = [str(page)]
+        return net.get(urlunparse(url._replace(query=urlencode(query, True)))).json()
 
 
 def get_mtgp_code(set_code: str, num: str, name: str):
     """
-    Webscrape to find the correct MTG Pics code for the card.
+    Find the correct MTG Pics code for the card using the set checklist.
     :param set_code: Set code of this card, ex: mh2
     :param num: Collector number of this card, ex: 220
     :return: Accurate mtgp linkage for this card
     """
-    try:
+    return match_mtgp_code(get_mtgp_checklist(set_code), num, name)
 
-        # Crawl the mtgpics site to find correct set code
-        r = requests.get("https://www.mtgpics.com/card?ref=" + set_code + "001")
-        soup = BeautifulSoup(r.content, "html.parser")
-        soup_td = soup.find("td", {"width": "170", "align": "center"})
-        replaced = soup_td.find("a")["href"].replace("set?", "set_checklist?")
-        mtgp_link = f"https://mtgpics.com/{replaced}"
-
-        # Crawl the set page to find the correct link
-        r = requests.get(mtgp_link)
-        soup = BeautifulSoup(r.content, "html.parser")
-        rows = soup.find_all(
-            "div",
-            {
-                "style": "display:block;margin:0px 2px 0px 2px;border-top:1px #cccccc dotted;"
-            },
-        )
 
-        # Look for collector number and name match
-        for row in rows:
-            cols = row.find_all("td")
-            if cols[0].text == num and name in cols[2].text:
-                return cols[2].find("a")["href"].replace("card?ref=", "")
+def match_mtgp_code(checklist: Optional[dict], num: str, name: str):
+    """
+    Match a card to its row in a set checklist.
+    :param checklist: Parsed set checklist
+    :param num: Collector number of this card, ex: 220
+    :param name: Name of this card
+    :return: Accurate mtgp linkage for this card, None if no row matches
+    """
+    if not checklist:
+        return None
 
-        # Collector number doesn't match, look only for the name
-        for row in rows:
-            cols = row.find_all("td")
-            if name in cols[2].text:
-                return cols[2].find("a")["href"].replace("card?ref=", "")
+    # Exact collector number and name match
+    code = checklist["index"].get((num, name))
+    if code:
+        return code
 
-    except (KeyError, TypeError, IndexError, AttributeError):
-        return None
+    # Look for collector number and partial name match
+    for row in checklist["rows"]:
+        if row["number"] == num and name in row["name"]:
+            return row["code"]
+
+    # Collector number doesn't match, look only for the name
+    for row in checklist["rows"]:
+        if name in row["name"]:
+            return row["code"]
     return None
 
 
 def get_mtgp_code_pmo(name: str, artist: str, set_name: str, promo: str = "pmo"):
     """
-    Webscrape to find the correct MTG Pics code for the card.
+    Find the correct MTG Pics code for a promo card using the promo checklist.
+    """
+    checklist = get_mtgp_promo_checklist(promo)
+    return match_mtgp_code_pmo(checklist, name, artist, set_name)
+
+
+def match_mtgp_code_pmo(
+    checklist: Optional[dict], name: str, artist: str, set_name: str
+):
+    """
+    Match a promo card to the closest row by its artist in a promo checklist.
+    :param checklist: Parsed promo checklist, indexed by artist
+    :param name: Name of this card
+    :param artist: Artist of this card
+    :param set_name: Scryfall set name, compared to the rest of the row name
+    :return: Accurate mtgp linkage for this card, None if no row matches
+    """
+    if not checklist:
+        return None
+
+    # Only compare rows by this artist
+    artist = normalize(artist)
+    candidates = checklist["artists"].get(artist)
+    if candidates is None:
+        candidates = [
+            row
+            for key, rows in checklist["artists"].items()
+            if artist in key
+            for row in rows
+        ]
+
+    # Track matches
+    matches = []
+    lower = name.lower()
+    for row in candidates:
+        if lower in row["lower"]:
+            matches.append(
+                {
+                    "code": row["code"],
+                    "match": SequenceMatcher(
+                        a=row["name"].replace(name, ""), b=set_name
+                    ).ratio(),
+                }
+            )
+    if not matches:
+        return None
+    return sorted(matches, key=lambda i: i["match"], reverse=True)[0]["code"]
+
+
+def get_mtgp_checklist(set_code: str) -> Optional[dict]:
+    """
+    Retrieve the parsed MTG Pics checklist for a set, scraped only once per run.
+    :param set_code: MTGP set code, ex: mh2
+    :return: Dict of checklist rows and (number, name) index, None if not found
+    """
+    return get_cached_checklist(set_code, lambda: fetch_mtgp_checklist(set_code))
+
+
+def get_mtgp_promo_checklist(promo: str = "pmo") -> Optional[dict]:
+    """
+    Retrieve the parsed MTG Pics checklist for a promo set, scraped only once per run.
+    :param promo: Promo set type, ex: pmo, dci, a22, uni
+    :return: Dict of checklist rows, (number, name) index and artist index, None if not found
+    """
+    url = get_promo_checklist_url(promo)
+    return get_cached_checklist(
+        url, lambda: index_promo_checklist(fetch_checklist(url))
+    )
+
+
+def get_promo_checklist_url(promo: str = "pmo") -> str:
+    """
+    URL of the MTG Pics checklist for a promo set.
+    :param promo: Promo set type, ex: pmo, dci, a22, uni
+    :return: Checklist URL, the pmo checklist for unknown types
+    """
+    return f"https://mtgpics.com/set_checklist?set={promo_sets.get(promo, 72)}"
+
+
+def get_cached_checklist(key: str, fetch: Callable) -> Optional[dict]:
+    """
+    Return a cached checklist, fetching it if this is the first request for it.
+    Concurrent requests for the same checklist wait on the first fetch.
+    :param key: Key to cache the checklist under
+    :param fetch: Function that fetches and parses the checklist
+    :return: Parsed checklist, None if it couldn't be retrieved
+    """
+    with checklist_lock:
+        lock = checklist_locks.setdefault(key, Lock())
+    with lock:
+        if key not in checklists:
+            checklists[key] = fetch()
+        return checklists[key]
+
+
+def fetch_mtgp_checklist(set_code: str) -> Optional[dict]:
+    """
+    Webscrape the MTG Pics checklist for a given set.
+    :param set_code: MTGP set code, ex: mh2
+    :return: Parsed checklist, None if it couldn't be retrieved
     """
     try:
-        # Track matches
-        matches = []
-
-        # Which promo set?
-        if promo == "dci":
-            req = "https://mtgpics.com/set_checklist?set=18"
-        elif promo == "a22":
-            req = "https://mtgpics.com/set_checklist?set=375"
-        elif promo == "uni":
-            req = "https://mtgpics.com/set_checklist?set=201"
-        else:
-            req = "https://mtgpics.com/set_checklist?set=72"
-
-        # Crawl the set page to find the correct link
-        r = requests.get(req)
-        soup = BeautifulSoup(r.content, "html.parser")
-        rows = soup.find_all(
-            "div",
-            {
-                "style": "display:block;margin:0px 2px 0px 2px;border-top:1px #cccccc dotted;"
-            },
-        )
-        for row in rows:
-            cols = row.find_all("td")
-            if (
-                artist in unidecode(cols[6].text)
-                and name.lower() in cols[2].text.lower()
-            ):
-                matches.append(
-                    {
-                        "code": cols[2].find("a")["href"].replace("card?ref=", ""),
-                        "match": SequenceMatcher(
-                            a=cols[2].text.replace(name, ""), b=set_name
-                        ).ratio(),
-                    }
-                )
-        return sorted(matches, key=lambda i: i["match"], reverse=True)[0]["code"]
+        # Crawl the mtgpics site to find correct set code
+        r = net.get("https://www.mtgpics.com/card?ref=" + set_code + "001")
+        link = mtgpics.offload(mtgpics.parse_set_link, r.content)
+        replaced = link.replace("set?", "set_checklist?")
     except (KeyError, TypeError, IndexError, AttributeError):
         return None
+    return fetch_checklist(f"https://mtgpics.com/{replaced}")
 
 
-def log(name: str, set_code: str, txt: str = "failed"):
+def forget_mtgp_set(set_code: str, codes: list) -> int:
+    """
+    Remove the cached MTG Pics pages of a set, so its next scrape fetches them again.
+    :param set_code: Scryfall set code, ex: mh2
+    :param codes: MTGP codes indexed for this set
+    :return: Number of cached pages removed
+    """
+    mtgp_set = cfg.replace_sets.get(set_code, set_code)
+    card_url = "https://www.mtgpics.com/card?ref="
+    urls = [net.normalize_url(card_url + code) for code in codes]
+
+    # The checklist is only linked from the set's first card page
+    entry = cache.get(net.normalize_url(f"{card_url}{mtgp_set}001"))
+    link = mtgpics.parse_set_link(entry["body"]) if entry else None
+    if link:
+        replaced = link.replace("set?", "set_checklist?")
+        urls.append(net.normalize_url(f"https://mtgpics.com/{replaced}"))
+
+    # Card pages guessed from set and collector number were never indexed
+    prefixes = {net.normalize_url(card_url + code) for code in (set_code, mtgp_set)}
+    return cache.delete(urls, sorted(prefixes))
+
+
+def fetch_checklist(url: str) -> Optional[dict]:
+    """
+    Webscrape an MTG Pics checklist page and index its rows.
+    :param url: URL of the set checklist page
+    :return: Dict of checklist rows and (number, name) index, None if not found
+    """
+    try:
+        r = net.get(url)
+        rows = mtgpics.offload(mtgpics.parse_checklist, r.content)
+    except (KeyError, TypeError, IndexError, AttributeError):
+        return None
+    return index_checklist(rows)
+
+
+def index_checklist(rows: list) -> dict:
+    """
+    Index the rows of a checklist by collector number and name.
+    :param rows: Rows parsed from the checklist page
+    :return: Dict of checklist rows and (number, name) index
+    """
+    return {
+        "rows": rows,
+        "index": {(row["number"], row["name"].strip()): row["code"] for row in rows},
+    }
+
+
+def index_promo_checklist(checklist: Optional[dict]) -> Optional[dict]:
+    """
+    Index the rows of a promo checklist by artist, normalizing each row once.
+    :param checklist: Parsed checklist
+    :return: Checklist with rows grouped by normalized artist, None if not found
+    """
+    if not checklist:
+        return None
+    artists: dict = {}
+    for row in checklist["rows"]:
+        row["lower"] = row["name"].lower()
+        artists.setdefault(normalize(row["artist"]), []).append(row)
+    checklist["artists"] = artists
+    return checklist
+
+
+def log(
+    name: str,
+    set_code: str,
+    txt: str = "failed",
+    card_id: Optional[str] = None,
+    reason: Optional[str] = None,
+):
     """
     Log card that couldn't be found.
     """
-    Path(os.path.join(cwd, "logs")).mkdir(mode=511, parents=True, exist_ok=True)
-    with open(os.path.join(cwd, f"logs/{txt}.txt"), "a", encoding="utf-8") as f:
-        f.write(f"{set_code}--{name}\n") if set_code else f.write(f"{name}\n")
-    print(f"{Fore.RED}FAILED: {Style.RESET_ALL}{name} [{set_code.upper()}]")
+    failures.add(name, set_code, txt, card_id, reason=reason)
+    console.alert(f"{Fore.RED}FAILED: {Style.RESET_ALL}{name} [{set_code.upper()}]")
 
 
 def get_card_face(entries: list, back: bool = False):
     """
     Determine which image should be downloaded when multiple are present.
     """
+    return get_card_faces(entries)[1 if back else 0]
+
+
+def get_card_faces(entries: list) -> tuple:
+    """
+    Determine which images are the front and back when multiple are present.
+    :param entries: Image entries scraped from the card page
+    :return: Tuple of front and back image links, None where a face has no image
+    """
 
     # Return none if entry list empty
     if len(entries) == 0:
-        return
+        return None, None
 
     # Format the image path
     arr = []
@@ -233,42 +463,34 @@ def get_card_face(entries: list, back: bool = False):
 
     # Strategy based on number of entries
     if len(arr) == 1:
-        if back:
-            return None
-        return f"{path}/{arr[0]}.jpg"
+        return f"{path}/{arr[0]}.jpg", None
     if len(arr) == 2:
-        if back:
-            return f"{path}/{sorted(arr)[1]}.jpg"
-        return f"{path}/{sorted(arr)[0]}.jpg"
-    if len(arr) > 2:
-
-        # Separate into string array and int array, sorted
-        img_i = []
-        img_s = []
-        arr.sort()
-
-        for i in arr:
-            if len(i) == 3:
-                img_i.append(i)
-            elif len(i) > 3:
-                img_s.append(i)
-
-        # Try comparing ints
-        if len(img_i) > 1:
-            if back:
-                return f"{path}/{img_i[1]}.jpg"
-            return f"{path}/{img_i[0]}.jpg"
-
-        # Try comparing strings
-        if len(img_s) > 1:
-            if back:
-                return f"{path}/{img_s[1]}.jpg"
-            return f"{path}/{img_s[0]}.jpg"
-
-        # Or just go in order
-        if back:
-            return f"{path}/{img_i[0]}.jpg"
-        return f"{path}/{img_s[0]}.jpg"
+        front, back = sorted(arr)
+        return f"{path}/{front}.jpg", f"{path}/{back}.jpg"
+
+    # Separate into string array and int array, sorted
+    img_i = []
+    img_s = []
+    arr.sort()
+
+    for i in arr:
+        if len(i) == 3:
+            img_i.append(i)
+        elif len(i) > 3:
+            img_s.append(i)
+
+    # Try comparing ints
+    if len(img_i) > 1:
+        return f"{path}/{img_i[0]}.jpg", f"{path}/{img_i[1]}.jpg"
+
+    # Try comparing strings
+    if len(img_s) > 1:
+        return f"{path}/{img_s[0]}.jpg", f"{path}/{img_s[1]}.jpg"
+
+    # Or just go in order
+    front = f"{path}/{img_s[0]}.jpg" if img_s else None
+    back = f"{path}/{img_i[0]}.jpg" if img_i else None
+    return front, back
 
 
 """
@@ -280,9 +502,73 @@ def get_mtg_set(code):
     """
     Return json data for MTG Set.
     :param code: Set code
-    :return: Dict of set data
+    :return: Dict of set data, None if the set doesn't exist
     """
-    try:
-        return requests.get(f"https://api.scryfall.com/sets/{code}").json()
-    except requests.exceptions.BaseHTTPError:
-        return None
+    return sets.get(code)
+
+
+def search_card_prints(name: str) -> list:
+    """
+    Return json data for each print of a card, newest first.
+    :param name: Exact card name
+    :return: List of card data
+    """
+    if cfg.bulk_data:
+        cards = bulk.search(name)
+        if not cards:
+            raise LookupError(f"No cards found named {name}")
+        return cards
+    return net.get(get_search_url(name)).json()["data"]
+
+
+def get_card_named(name: str, set_code: Optional[str] = None) -> dict:
+    """
+    Return json data for a card using a fuzzy name lookup.
+    :param name: Card name, can be partial or misspelled
+    :param set_code: Set code to look in, ex: mh2
+    :return: Dict of card data
+    """
+    if cfg.bulk_data:
+        card = bulk.named(name, set_code)
+        if not card:
+            raise LookupError(f"No card found named {name}")
+        return card
+    return net.get(get_named_url(name, set_code)).json()
+
+
+def get_cards_collection(identifiers: list) -> list:
+    """
+    Return json data for a batch of cards.
+    :param identifiers: List of up to 75 Scryfall card identifiers
+    :return: List of card data for each identifier that was found
+    """
+    if cfg.bulk_data:
+        return bulk.collection(identifiers)
+    return net.post(collection_url, json={"identifiers": identifiers}).json()["data"]
+
+
+def get_search_url(name: str) -> str:
+    """
+    Scryfall search URL for every print of a card.
+    :param name: Exact card name
+    :return: Search URL following the search settings
+    """
+    return (
+        f'https://api.scryfall.com/cards/search?q=!"{quote(name)}"'
+        f"&unique={cfg.unique}"
+        f"&include_extras={cfg.include_extras}"
+        "&order=released"
+    )
+
+
+def get_named_url(name: str, set_code: Optional[str] = None) -> str:
+    """
+    Scryfall fuzzy named lookup URL for a card.
+    :param name: Card name, can be partial or misspelled
+    :param set_code: Set code to look in, ex: mh2
+    :return: Named lookup URL
+    """
+    url = f"https://api.scryfall.com/cards/named?fuzzy={quote(name)}"
+    if set_code:
+        url += f"&set={quote(set_code.lower())}"
+    return url
@@ -0,0 +1,112 @@
+"""
+FAILURE LOG
+"""
+import os
+import json
+import time
+import atexit
+from pathlib import Path
+from threading import Thread, Lock, Event
+from typing import Optional
+from lib import settings as cfg
+
+# Seconds between writes of buffered failures
+FLUSH_INTERVAL = 5
+# Buffered failures that trigger an early write
+FLUSH_SIZE = 500
+
+# Reason recorded for each plain text log
+REASONS = {
+    "failed": "No image found",
+    "failed_front": "Front image not found",
+    "failed_back": "Back image not found",
+}
+
+
+class FailureLog:
+    """
+    Collects failures from every download thread, writing them to disk in batches.
+    Each failure goes to its plain text log for re-feeding, and to failures.jsonl.
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.buffer: list = []
+        self.lock = Lock()
+        self.write_lock = Lock()
+        self.wake = Event()
+        self.thread: Optional[Thread] = None
+
+    def add(
+        self,
+        name: str,
+        set_code: str,
+        txt: str = "failed",
+        card_id: Optional[str] = None,
+        source: Optional[str] = None,
+        reason: Optional[str] = None,
+    ) -> None:
+        """
+        Buffer a failure to be written.
+        :param name: Card name
+        :param set_code: Set code of the card
+        :param txt: Name of the plain text log, ex: failed
+        :param card_id: Scryfall card id
+        :param source: Where the image was looked for, mtgp or scryfall
+        :param reason: Why the card failed, defaults to the reason for this log
+        """
+        entry = {
+            "name": name,
+            "set": set_code,
+            "log": txt,
+            "reason": reason or REASONS.get(txt, txt),
+            "source": source or ("scryfall" if cfg.only_scryfall else "mtgp"),
+            "id": card_id,
+            "time": time.time(),
+        }
+        with self.lock:
+            self.buffer.append(entry)
+            if not self.thread:
+                self.thread = Thread(target=self.run, daemon=True)
+                self.thread.start()
+            if len(self.buffer) >= FLUSH_SIZE:
+                self.wake.set()
+
+    def run(self) -> None:
+        """
+        Write buffered failures periodically, or early when the buffer fills.
+        """
+        while True:
+            self.wake.wait(FLUSH_INTERVAL)
+            self.wake.clear()
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write every buffered failure to disk.
+        """
+        with self.write_lock:
+            with self.lock:
+                entries, self.buffer = self.buffer, []
+            if not entries:
+                return
+
+            # Group plain text lines by log file
+            lines: dict = {}
+            for e in entries:
+                line = f"{e['set']}--{e['name']}\n" if e["set"] else f"{e['name']}\n"
+                lines.setdefault(e["log"], []).append(line)
+            Path(self.folder).mkdir(mode=511, parents=True, exist_ok=True)
+            for txt, text in lines.items():
+                with open(
+                    os.path.join(self.folder, f"{txt}.txt"), "a", encoding="utf-8"
+                ) as f:
+                    f.writelines(text)
+            with open(
+                os.path.join(self.folder, "failures.jsonl"), "a", encoding="utf-8"
+            ) as f:
+                f.writelines(json.dumps(e) + "\n" for e in entries)
+
+
+failures = FailureLog(os.path.join(cfg.cwd, "logs"))
+atexit.register(failures.flush)
@@ -0,0 +1,248 @@
+"""
+HTTP RESPONSE CACHE
+"""
+import os
+import json
+import time
+import atexit
+import sqlite3
+from threading import Lock
+from typing import Optional
+from lib import settings as cfg
+
+# Response headers kept with each body
+KEPT_HEADERS = ["Content-Type", "ETag", "Last-Modified"]
+# Writes held in a transaction before they're committed to disk
+COMMIT_SIZE = 100
+# Seconds writes are held before they're committed to disk
+COMMIT_INTERVAL = 30
+
+
+class ResponseCache:
+    """
+    On-disk cache of GET responses keyed by URL, so repeat runs skip refetching pages.
+    Responses are served as is while fresh, then revalidated with a conditional GET.
+    The least recently used responses are evicted once the cache outgrows its size.
+    Lookups never write, and writes are committed in batches.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn: Optional[sqlite3.Connection] = None
+        self.size = 0
+        # Last use of each response looked up since the last commit
+        self.used: dict = {}
+        self.pending = 0
+        self.committed = time.monotonic()
+        self.lock = Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Open the cache database, creating the table if needed.
+        """
+        if not self.conn:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.executescript(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "url TEXT PRIMARY KEY, headers TEXT, body BLOB, size INTEGER, "
+                "fetched REAL, used REAL);"
+                "CREATE INDEX IF NOT EXISTS responses_used ON responses (used);"
+            )
+            self.size = self.conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()[0]
+        return self.conn
+
+    @staticmethod
+    def cacheable(method: str, **kwargs) -> bool:
+        """
+        Check if a request's response can be cached.
+        :param method: HTTP method, ex: GET
+        :return: True for plain GET requests while the cache is enabled
+        """
+        if not cfg.cache_enabled or method.upper() != "GET":
+            return False
+        return not any(kwargs.get(k) for k in ["stream", "headers", "params"])
+
+    @staticmethod
+    def is_fresh(entry: dict) -> bool:
+        """
+        Check if a cached response can be used without revalidating it.
+        :param entry: Cached response
+        :return: True if it was fetched or revalidated within the freshness window
+        """
+        return time.time() - entry["fetched"] < cfg.cache_fresh * 3600
+
+    @staticmethod
+    def validators(entry: dict) -> dict:
+        """
+        Headers turning a request into a conditional GET for a cached response.
+        :param entry: Cached response
+        :return: Dict of If-None-Match and If-Modified-Since headers
+        """
+        headers = {}
+        if entry["headers"].get("ETag"):
+            headers["If-None-Match"] = entry["headers"]["ETag"]
+        if entry["headers"].get("Last-Modified"):
+            headers["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+        return headers
+
+    def get(self, url: str) -> Optional[dict]:
+        """
+        Look up the cached response for a URL.
+        :param url: URL requested
+        :return: Dict of headers, body and when it was fetched, None if not cached
+        """
+        if not cfg.cache_enabled:
+            return None
+        with self.lock:
+            row = (
+                self.connect()
+                .execute(
+                    "SELECT headers, body, fetched FROM responses WHERE url = ?",
+                    (url,),
+                )
+                .fetchone()
+            )
+            if not row:
+                return None
+            self.used[url] = time.time()
+        return {"headers": json.loads(row[0]), "body": row[1], "fetched": row[2]}
+
+    def put(self, url: str, headers, body: bytes) -> None:
+        """
+        Store a response, evicting the least recently used ones to make room.
+        :param url: URL requested
+        :param headers: Response headers
+        :param body: Response body
+        """
+        if not cfg.cache_enabled or len(body) > cfg.cache_size:
+            return
+        # Header names are case insensitive, and clients differ on case
+        received = {k.lower(): v for k, v in headers.items()}
+        kept = {k: received[k.lower()] for k in KEPT_HEADERS if received.get(k.lower())}
+        now = time.time()
+        with self.lock:
+            conn = self.connect()
+            old = conn.execute(
+                "SELECT size FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (url, json.dumps(kept), body, len(body), now, now),
+            )
+            self.size += len(body) - (old[0] if old else 0)
+            self.used.pop(url, None)
+            self.evict(conn)
+            self.written(conn)
+
+    def revalidated(self, url: str) -> None:
+        """
+        Mark a cached response as fresh again, after the server said it's unchanged.
+        :param url: URL requested
+        """
+        with self.lock:
+            conn = self.connect()
+            now = time.time()
+            conn.execute(
+                "UPDATE responses SET fetched = ?, used = ? WHERE url = ?",
+                (now, now, url),
+            )
+            self.used.pop(url, None)
+            self.written(conn)
+
+    def written(self, conn: sqlite3.Connection) -> None:
+        """
+        Count a write, committing once enough have built up or they're held too long.
+        :param conn: Open cache database, with the lock held
+        """
+        self.pending += 1
+        if (
+            self.pending >= COMMIT_SIZE
+            or time.monotonic() - self.committed > COMMIT_INTERVAL
+        ):
+            self.commit(conn)
+
+    def commit(self, conn: sqlite3.Connection) -> None:
+        """
+        Write the last use of each response looked up, then commit every held write.
+        :param conn: Open cache database, with the lock held
+        """
+        self.write_used(conn)
+        conn.commit()
+        self.pending = 0
+        self.committed = time.monotonic()
+
+    def write_used(self, conn: sqlite3.Connection) -> None:
+        """
+        Write the last use of each response looked up since the last commit.
+        :param conn: Open cache database, with the lock held
+        """
+        if self.used:
+            conn.executemany(
+                "UPDATE responses SET used = ? WHERE url = ?",
+                [(used, url) for url, used in self.used.items()],
+            )
+            self.used = {}
+
+    def flush(self) -> None:
+        """
+        Commit every held write to disk.
+        """
+        with self.lock:
+            if self.conn:
+                self.commit(self.conn)
+
+    def delete(self, urls: list, prefixes: list) -> int:
+        """
+        Remove cached responses, so they're fetched again on the next request.
+        :param urls: URLs to remove
+        :param prefixes: Remove every URL starting with one of these too
+        :return: Number of responses removed
+        """
+        if not os.path.exists(self.path):
+            return 0
+        with self.lock:
+            conn = self.connect()
+            rows = set()
+            for url in urls:
+                rows.update(
+                    conn.execute(
+                        "SELECT url, size FROM responses WHERE url = ?", (url,)
+                    ).fetchall()
+                )
+            for prefix in prefixes:
+                rows.update(
+                    conn.execute(
+                        "SELECT url, size FROM responses WHERE substr(url, 1, ?) = ?",
+                        (len(prefix), prefix),
+                    ).fetchall()
+                )
+            for url, size in rows:
+                conn.execute("DELETE FROM responses WHERE url = ?", (url,))
+                self.used.pop(url, None)
+                self.size -= size
+            # Commit right away, stale pages must not outlive the invalidation
+            self.commit(conn)
+        return len(rows)
+
+    def evict(self, conn: sqlite3.Connection) -> None:
+        """
+        Remove the least recently used responses until the cache fits its size.
+        :param conn: Open cache database, with the lock held
+        """
+        if self.size <= cfg.cache_size:
+            return
+        # Order by the latest uses, including ones not written yet
+        self.write_used(conn)
+        for url, size in conn.execute(
+            "SELECT url, size FROM responses ORDER BY used"
+        ).fetchall():
+            conn.execute("DELETE FROM responses WHERE url = ?", (url,))
+            self.size -= size
+            if self.size <= cfg.cache_size:
+                break
+
+
+cache = ResponseCache(os.path.join(cfg.folder, "http_cache.sqlite3"))
+atexit.register(cache.flush)
@@ -0,0 +1,167 @@
+"""
+PERSISTENT MTGPICS INDEX
+"""
+import os
+import json
+import time
+import sqlite3
+from threading import Lock
+from typing import Optional
+from lib import settings as cfg
+
+
+class Index:
+    """
+    On-disk index of resolved MTGP codes and art URLs, so repeat runs skip scraping.
+    Entries are keyed by Scryfall set, and expire based on that set's TTL.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn: Optional[sqlite3.Connection] = None
+        self.lock = Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Open the index database, creating the tables if needed.
+        """
+        if not self.conn:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.executescript(
+                "CREATE TABLE IF NOT EXISTS codes ("
+                "set_code TEXT, num TEXT, name TEXT, code TEXT, fetched REAL, "
+                "PRIMARY KEY (set_code, num, name));"
+                "CREATE TABLE IF NOT EXISTS images ("
+                "code TEXT PRIMARY KEY, set_code TEXT, images TEXT, fetched REAL);"
+                "CREATE INDEX IF NOT EXISTS images_set ON images (set_code);"
+            )
+        return self.conn
+
+    @staticmethod
+    def expired(set_code: str, fetched: float) -> bool:
+        """
+        Check if an entry for this set is older than the set's TTL.
+        :param set_code: Scryfall set code
+        :param fetched: Timestamp the entry was stored
+        :return: True if the entry should be scraped again
+        """
+        ttl = cfg.index_ttl_sets.get(set_code.lower(), cfg.index_ttl)
+        return time.time() - fetched > ttl * 86400
+
+    def get_code(self, set_code: str, num: str, name: str) -> Optional[str]:
+        """
+        Look up the MTGP code for a card.
+        :param set_code: Scryfall set code, ex: mh2
+        :param num: Collector number, ex: 220
+        :param name: Card name as searched on MTGP
+        :return: MTGP code if indexed and not expired, otherwise None
+        """
+        if not cfg.index_enabled:
+            return None
+        with self.lock:
+            row = (
+                self.connect()
+                .execute(
+                    "SELECT code, fetched FROM codes "
+                    "WHERE set_code = ? AND num = ? AND name = ?",
+                    (set_code, num, name),
+                )
+                .fetchone()
+            )
+        if not row or self.expired(set_code, row[1]):
+            return None
+        return row[0]
+
+    def set_code(self, set_code: str, num: str, name: str, code: str) -> None:
+        """
+        Store the MTGP code for a card.
+        :param set_code: Scryfall set code, ex: mh2
+        :param num: Collector number, ex: 220
+        :param name: Card name as searched on MTGP
+        :param code: Resolved MTGP code
+        """
+        if not cfg.index_enabled:
+            return
+        with self.lock:
+            conn = self.connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO codes VALUES (?, ?, ?, ?, ?)",
+                (set_code, num, name, code, time.time()),
+            )
+            conn.commit()
+
+    def get_images(self, code: str) -> Optional[list]:
+        """
+        Look up the art image sources found on an MTGP card page.
+        :param code: MTGP code of the card page
+        :return: List of image sources if indexed and not expired, otherwise None
+        """
+        if not cfg.index_enabled:
+            return None
+        with self.lock:
+            row = (
+                self.connect()
+                .execute(
+                    "SELECT set_code, images, fetched FROM images WHERE code = ?",
+                    (code,),
+                )
+                .fetchone()
+            )
+        if not row or self.expired(row[0], row[2]):
+            return None
+        return json.loads(row[1])
+
+    def set_images(self, set_code: str, code: str, images: list) -> None:
+        """
+        Store the art image sources found on an MTGP card page.
+        :param set_code: Scryfall set code, ex: mh2
+        :param code: MTGP code of the card page
+        :param images: List of image sources
+        """
+        if not cfg.index_enabled:
+            return
+        with self.lock:
+            conn = self.connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?)",
+                (code, set_code, json.dumps(images), time.time()),
+            )
+            conn.commit()
+
+    def get_set_codes(self, set_code: str) -> list:
+        """
+        Look up every MTGP code indexed for a set, expired or not.
+        :param set_code: Scryfall set code, ex: mh2
+        :return: List of MTGP codes
+        """
+        with self.lock:
+            rows = (
+                self.connect()
+                .execute(
+                    "SELECT code FROM codes WHERE set_code = ? "
+                    "UNION SELECT code FROM images WHERE set_code = ?",
+                    (set_code, set_code),
+                )
+                .fetchall()
+            )
+        return [row[0] for row in rows]
+
+    def invalidate(self, set_code: str) -> int:
+        """
+        Remove every entry for a set, forcing it to be scraped again.
+        :param set_code: Scryfall set code, ex: mh2
+        :return: Number of entries removed
+        """
+        with self.lock:
+            conn = self.connect()
+            removed = conn.execute(
+                "DELETE FROM codes WHERE set_code = ?", (set_code,)
+            ).rowcount
+            removed += conn.execute(
+                "DELETE FROM images WHERE set_code = ?", (set_code,)
+            ).rowcount
+            conn.commit()
+        return removed
+
+
+index = Index(os.path.join(cfg.folder, "mtgp_index.sqlite3"))
@@ -0,0 +1,97 @@
+"""
+DOWNLOAD MANIFEST
+"""
+import os
+import json
+from threading import Lock
+from typing import Optional
+from lib import settings as cfg
+
+
+class Manifest:
+    """
+    Record of every image downloaded, appended to as each download completes.
+    Used to skip cards that were already downloaded on a previous run.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Optional[dict] = None
+        self.lock = Lock()
+
+    def load(self) -> dict:
+        """
+        Read the manifest, keeping the latest entry for each card face.
+        :return: Dict of entries keyed by card id and face
+        """
+        with self.lock:
+            if self.entries is None:
+                self.entries = {}
+                if os.path.isfile(self.path):
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        for line in f:
+                            try:
+                                entry = json.loads(line)
+                            except json.JSONDecodeError:
+                                # Line cut off by an interrupted run
+                                continue
+                            self.entries[(entry["id"], entry["face"])] = entry
+            return self.entries
+
+    def add(
+        self, card_id: str, face: str, source: str, url: str, path: str, info: dict
+    ) -> None:
+        """
+        Record a completed download.
+        :param card_id: Scryfall card id
+        :param face: Card face, front or back
+        :param source: Where the image came from, mtgp or scryfall
+        :param url: URL of the image
+        :param path: Path the image was saved to
+        :param info: ETag, size and hash of the downloaded file
+        """
+        entry = {
+            "id": card_id,
+            "face": face,
+            "source": source,
+            "url": url,
+            "path": path,
+        }
+        entry.update(info)
+        entries = self.load()
+        with self.lock:
+            entries[(card_id, face)] = entry
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def is_downloaded(self, card_id: str, face: str, source: str) -> bool:
+        """
+        Check if a card face was downloaded from this source and is still on disk.
+        :param card_id: Scryfall card id
+        :param face: Card face, front or back
+        :param source: Where the image came from, mtgp or scryfall
+        :return: True if the file exists with the recorded size
+        """
+        entry = self.load().get((card_id, face))
+        if not entry or entry["source"] != source:
+            return False
+        try:
+            return os.path.getsize(entry["path"]) == entry["size"]
+        except OSError:
+            return False
+
+    def is_complete(self, card_id: str, faces: int) -> bool:
+        """
+        Check if every face of a card was already downloaded from the preferred source.
+        :param card_id: Scryfall card id
+        :param faces: Number of faces the card has
+        :return: True if the card can be skipped
+        """
+        source = "scryfall" if cfg.only_scryfall else "mtgp"
+        return all(
+            self.is_downloaded(card_id, face, source)
+            for face in ["front", "back"][:faces]
+        )
+
+
+manifest = Manifest(os.path.join(cfg.folder, "manifest.jsonl"))
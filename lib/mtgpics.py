@@ -0,0 +1,253 @@
+"""
+MTGPICS PAGE EXTRACTION
+"""
+from concurrent.futures import ProcessPoolExecutor
+from html.parser import HTMLParser
+from threading import Lock
+from typing import Callable, Optional
+from lib import settings as cfg
+
+try:
+    from lxml import html as lxml_html
+except ImportError:
+    lxml_html = None
+
+# Inline styles marking the elements we extract
+ROW_STYLE = "display:block;margin:0px 2px 0px 2px;border-top:1px #cccccc dotted;"
+IMG_STYLE = "display:block;border:4px black solid;cursor:pointer;"
+
+# Process pool for parsing, created on first use
+executor: Optional[ProcessPoolExecutor] = None
+executor_lock = Lock()
+
+# Tags that never have a closing tag
+VOID_TAGS = {
+    "area",
+    "base",
+    "br",
+    "col",
+    "embed",
+    "hr",
+    "img",
+    "input",
+    "link",
+    "meta",
+    "source",
+    "wbr",
+}
+
+
+def parse_checklist(content: bytes) -> list:
+    """
+    Parse the rows of an MTG Pics checklist page.
+    :param content: HTML content of the checklist page
+    :return: List of rows containing collector number, name, MTGP code and artist
+    """
+    if lxml_html is not None:
+        tables = [
+            [(td.text_content(), td.xpath(".//a/@href")) for td in div.iter("td")]
+            for div in xpath(content, "//div[@style=$style]", style=ROW_STYLE)
+        ]
+    else:
+        parser = ChecklistParser()
+        parser.feed(decode(content))
+        parser.close()
+        tables = parser.rows
+
+    rows = []
+    for cols in tables:
+        if len(cols) < 3 or not cols[2][1]:
+            continue
+        rows.append(
+            {
+                "number": cols[0][0],
+                "name": cols[2][0],
+                "code": cols[2][1][0].replace("card?ref=", ""),
+                "artist": cols[6][0] if len(cols) > 6 else "",
+            }
+        )
+    return rows
+
+
+def parse_card_images(content: bytes) -> list:
+    """
+    Parse the art images shown on an MTG Pics card page.
+    :param content: HTML content of the card page
+    :return: List of image sources
+    """
+    if lxml_html is not None:
+        return xpath(content, "//img[@style=$style]/@src", style=IMG_STYLE)
+    parser = ImageParser()
+    parser.feed(decode(content))
+    parser.close()
+    return parser.images
+
+
+def parse_set_link(content: bytes) -> Optional[str]:
+    """
+    Parse the link to the set page from an MTG Pics card page.
+    :param content: HTML content of the card page
+    :return: Relative URL of the set page, None if not found
+    """
+    if lxml_html is not None:
+        links = xpath(content, '(//td[@width="170" and @align="center"])[1]//a/@href')
+        return links[0] if links else None
+    parser = SetLinkParser()
+    parser.feed(decode(content))
+    parser.close()
+    return parser.link
+
+
+def get_executor() -> Optional[ProcessPoolExecutor]:
+    """
+    Process pool parsing pages outside the GIL, if enabled.
+    :return: Shared process pool, None if parsing happens in the calling thread
+    """
+    global executor
+    if not cfg.parse_processes:
+        return None
+    with executor_lock:
+        if executor is None:
+            executor = ProcessPoolExecutor(max_workers=cfg.parse_processes)
+        return executor
+
+
+def offload(func: Callable, content: bytes):
+    """
+    Parse a page in the process pool, or in this thread if the pool is disabled.
+    :param func: Parsing function from this module
+    :param content: HTML content of the page
+    :return: Result of the parsing function
+    """
+    pool = get_executor()
+    if pool is None:
+        return func(content)
+    return pool.submit(func, content).result()
+
+
+def xpath(content: bytes, path: str, **variables) -> list:
+    """
+    Parse a page with lxml and run an XPath query on it.
+    :param content: HTML content of the page
+    :param path: XPath query
+    :return: List of matching elements or attribute values
+    """
+    try:
+        return lxml_html.fromstring(content).xpath(path, **variables)
+    except lxml_html.etree.ParserError:
+        # Empty page
+        return []
+
+
+def decode(content: bytes) -> str:
+    """
+    Decode page content for the fallback parsers.
+    :param content: HTML content of the page
+    :return: Decoded HTML
+    """
+    if isinstance(content, str):
+        return content
+    try:
+        return content.decode("utf-8")
+    except UnicodeDecodeError:
+        return content.decode("windows-1252", errors="replace")
+
+
+"""
+FALLBACK PARSERS
+"""
+
+
+class ChecklistParser(HTMLParser):
+    """
+    Streaming parser keeping only the cells inside checklist row divs.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.rows: list = []
+        self.stack: list = []
+        self.cols: list = []
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        if not self.stack:
+            if tag == "div" and dict(attrs).get("style") == ROW_STYLE:
+                self.stack, self.cols = [["div"]], []
+            return
+        if tag in VOID_TAGS:
+            return
+        if tag == "td":
+            # Cell text, and the links inside it
+            self.cols.append(("", []))
+            self.stack.append(["td", len(self.cols) - 1])
+        else:
+            self.stack.append([tag])
+        if tag == "a":
+            href = dict(attrs).get("href")
+            for entry in self.stack:
+                if entry[0] == "td" and href is not None:
+                    self.cols[entry[1]][1].append(href)
+
+    def handle_endtag(self, tag: str) -> None:
+        if not self.stack:
+            return
+        # Close any unclosed tags inside this one
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self.stack[i][0] == tag:
+                del self.stack[i:]
+                break
+        if not self.stack:
+            self.rows.append(self.cols)
+
+    def handle_data(self, data: str) -> None:
+        for entry in self.stack:
+            if entry[0] == "td":
+                text, links = self.cols[entry[1]]
+                self.cols[entry[1]] = (text + data, links)
+
+
+class ImageParser(HTMLParser):
+    """
+    Streaming parser keeping only the sources of art images.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.images: list = []
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        if tag == "img":
+            a = dict(attrs)
+            if a.get("style") == IMG_STYLE and "src" in a:
+                self.images.append(a["src"])
+
+
+class SetLinkParser(HTMLParser):
+    """
+    Streaming parser keeping only the first link in the set info cell.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.link: Optional[str] = None
+        self.depth = 0
+        self.done = False
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        if self.done:
+            return
+        a = dict(attrs)
+        if not self.depth:
+            if tag == "td" and a.get("width") == "170" and a.get("align") == "center":
+                self.depth = 1
+            return
+        if tag == "td":
+            self.depth += 1
+        elif tag == "a" and a.get("href") is not None:
+            self.link, self.done = a["href"], True
+
+    def handle_endtag(self, tag: str) -> None:
+        if self.depth and tag == "td":
+            self.depth -= 1
+            if not self.depth:
+                self.done = True
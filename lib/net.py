@@ -0,0 +1,591 @@
+"""
+NETWORK FUNCTIONS
+"""
+import os
+import json
+import hashlib
+import random
+import time
+from collections import deque
+from concurrent.futures import Future
+from email.utils import parsedate_to_datetime
+from threading import Lock
+from typing import Callable, Optional
+from urllib.parse import urlparse, urlencode, parse_qsl
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ChunkedEncodingError
+from lib import settings as cfg
+from lib.constants import console
+from lib.httpcache import cache
+
+
+class TokenBucket:
+    """
+    Token bucket limiting how many requests per second can be made to a host.
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = Lock()
+
+    def acquire(self) -> float:
+        """
+        Take a token, waiting until one is available.
+        :return: Seconds spent waiting
+        """
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def reserve(self) -> float:
+        """
+        Take a token without waiting for it.
+        :return: Seconds the caller must wait before using the token
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+
+            # Reserve a token, wait for it if the bucket is in debt
+            self.tokens -= 1
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+
+class CircuitBreaker:
+    """
+    Watches the error and latency rate of requests to a host.
+    Once too many fail or are too slow, requests fail fast until a cooldown passes,
+    then a single request is let through to test if the host recovered.
+    """
+
+    def __init__(self, host: str):
+        self.host = host
+        self.results: deque = deque(maxlen=cfg.breaker_window)
+        self.opened: Optional[float] = None
+        self.probing = False
+        self.lock = Lock()
+
+    def allow(self) -> bool:
+        """
+        Check if a request to this host can be made.
+        :return: True if the circuit is closed, or this request tests the host
+        """
+        with self.lock:
+            if self.opened is None:
+                return True
+            if self.probing or self.remaining() > 0:
+                return False
+            self.probing = True
+            return True
+
+    def record(self, ok: bool, elapsed: float) -> None:
+        """
+        Record the outcome of a request, opening or closing the circuit.
+        :param ok: False if the request failed with an error worth retrying
+        :param elapsed: Seconds the request took
+        """
+        ok = ok and elapsed < cfg.breaker_slow
+        with self.lock:
+            if self.opened is not None:
+                if self.probing:
+                    # Test request decides if the host recovered
+                    self.probing = False
+                    if ok:
+                        self.opened = None
+                        self.results.clear()
+                        console.alert(f"{self.host} recovered, resuming requests")
+                    else:
+                        self.opened = time.monotonic()
+                return
+            self.results.append(ok)
+            if len(self.results) == self.results.maxlen and self.results.count(
+                False
+            ) >= cfg.breaker_error_rate * len(self.results):
+                self.opened = time.monotonic()
+                console.alert(
+                    f"{self.host} is failing, skipping it for "
+                    f"{cfg.breaker_cooldown:.0f} seconds"
+                )
+
+    def half_open(self) -> bool:
+        """
+        Check if the cooldown has passed, so the next request tests the host.
+        :return: True if the circuit is open but waiting for a test request
+        """
+        return self.opened is not None and not self.remaining()
+
+    def remaining(self) -> float:
+        """
+        Seconds until a request is let through to test the host.
+        :return: Seconds left in the cooldown, 0 if the circuit is closed
+        """
+        if self.opened is None:
+            return 0
+        return max(0.0, self.opened + cfg.breaker_cooldown - time.monotonic())
+
+
+class SingleFlight:
+    """
+    Shares one in-flight call between every thread asking for the same thing.
+    Results aren't kept, a call made after the first finishes runs again.
+    """
+
+    def __init__(self):
+        self.calls: dict = {}
+        self.lock = Lock()
+
+    def do(self, key: tuple, func: Callable, *args):
+        """
+        Run the call, or wait for the matching call already running.
+        :param key: Key identifying the call
+        :param func: Function to call if nothing matching is in flight
+        :return: Result of the call, shared with every thread that asked for it
+        """
+        with self.lock:
+            running: Optional[Future] = self.calls.get(key)
+            if running is None:
+                future: Future = Future()
+                self.calls[key] = future
+        if running is not None:
+            return running.result()
+        try:
+            result = func(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+
+# Seconds to wait on a connection or read before giving up
+TIMEOUT = 30
+# Bytes written to disk at a time while downloading
+CHUNK_SIZE = 65536
+
+
+class IncompleteDownload(requests.RequestException):
+    """
+    Download ended before the full file was received.
+    """
+
+
+class TransientError(requests.RequestException):
+    """
+    Request kept failing with errors worth retrying, like timeouts or server errors.
+    Kept apart from real misses so the card can be tried again later.
+    """
+
+
+class CircuitOpen(TransientError):
+    """
+    Host is failing or too slow, so requests to it are skipped until it recovers.
+    """
+
+
+# Status codes worth retrying, and the error class each counts against
+RETRY_STATUSES = {
+    429: "rate_limited",
+    500: "server",
+    502: "server",
+    503: "server",
+    504: "server",
+}
+
+
+def create_session() -> requests.Session:
+    """
+    Create the HTTP session shared by every request, keeping connections alive.
+    :return: Session with a connection pool for each host sized to the worker count
+    """
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=cfg.max_workers)
+    s = requests.Session()
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    s.headers.update(
+        {"User-Agent": "MTG-Art-Downloader", "Accept-Encoding": "gzip, deflate"}
+    )
+    return s
+
+
+# Shared session, connection pools are thread safe
+session = create_session()
+
+# Token bucket for each rate limited host
+buckets = {host: TokenBucket(rate) for host, rate in cfg.rate_limits.items() if rate}
+
+# Requests in flight, shared by threads making the same request
+flights = SingleFlight()
+
+# Circuit breaker for each host requested
+breakers: dict = {}
+breakers_lock = Lock()
+
+
+def get_bucket(url: str) -> Optional[TokenBucket]:
+    """
+    Find the token bucket limiting requests to this URL's host.
+    :param url: URL being requested
+    :return: Token bucket for the host, None if the host isn't limited
+    """
+    host = (urlparse(url).hostname or "").lower()
+    for limited, bucket in buckets.items():
+        if host == limited or host.endswith(f".{limited}"):
+            return bucket
+    return None
+
+
+def get_breaker(url: str) -> Optional[CircuitBreaker]:
+    """
+    Find the circuit breaker watching this URL's host.
+    :param url: URL being requested
+    :return: Circuit breaker for the host, None if circuit breakers are disabled
+    """
+    if not cfg.breaker_enabled:
+        return None
+    host = (urlparse(url).hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    with breakers_lock:
+        if host not in breakers:
+            breakers[host] = CircuitBreaker(host)
+        return breakers[host]
+
+
+def check_breaker(breaker: Optional[CircuitBreaker], url: str) -> None:
+    """
+    Fail fast if the circuit for this URL's host is open.
+    :param breaker: Circuit breaker for the host
+    :param url: URL being requested
+    """
+    if breaker and not breaker.allow():
+        raise CircuitOpen(f"{breaker.host} is unavailable, skipped {url}")
+
+
+def limit(url: str) -> None:
+    """
+    Wait until the rate limit for this URL's host allows another request.
+    :param url: URL being requested
+    """
+    bucket = get_bucket(url)
+    if bucket:
+        bucket.acquire()
+
+
+"""
+RETRY POLICY
+"""
+
+
+def classify_error(e: Exception) -> Optional[str]:
+    """
+    Find the error class a failed request counts against.
+    :param e: Exception raised by the request
+    :return: Error class, None if the error isn't worth retrying
+    """
+    if isinstance(e, TransientError):
+        # Already retried
+        return None
+    if isinstance(e, requests.Timeout):
+        return "timeout"
+    if isinstance(
+        e, (requests.ConnectionError, ChunkedEncodingError, IncompleteDownload)
+    ):
+        return "connection"
+    return None
+
+
+def retry_delay(
+    error: str, attempts: dict, retry_after: Optional[str] = None
+) -> Optional[float]:
+    """
+    Count a retry against its error class, and find how long to wait before it.
+    :param error: Error class, ex: timeout
+    :param attempts: Retries made so far for this request by error class
+    :param retry_after: Retry-After header sent with the error, if any
+    :return: Seconds to wait, None if this error class is out of retries
+    """
+    attempts[error] = attempts.get(error, 0) + 1
+    if attempts[error] > cfg.retry_attempts.get(error, 0):
+        return None
+
+    # Wait as long as the server asked
+    if retry_after:
+        try:
+            wait = float(retry_after)
+        except ValueError:
+            try:
+                wait = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                wait = 0
+        if wait > 0:
+            return min(wait, cfg.retry_max_delay)
+
+    # Exponential backoff with full jitter
+    delay = min(cfg.retry_max_delay, cfg.retry_delay * 2 ** (attempts[error] - 1))
+    return random.uniform(0, delay)
+
+
+def normalize_url(url: str) -> str:
+    """
+    Normalize a URL so the same resource is always requested the same way.
+    :param url: URL to normalize
+    :return: URL with a lowercase host, no www prefix and sorted query parameters
+    """
+    parts = urlparse(url)
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return parts._replace(netloc=host, query=query, fragment="").geturl()
+
+
+def request_key(method: str, url: str, **kwargs) -> Optional[tuple]:
+    """
+    Key identifying a request, so identical requests in flight can be shared.
+    :param method: HTTP method, ex: GET
+    :param url: URL to request
+    :return: Key for the request, None if it can't be shared
+    """
+    # Streamed bodies and custom headers belong to a single caller
+    if kwargs.get("stream") or kwargs.get("headers"):
+        return None
+    params = sorted((kwargs.get("params") or {}).items())
+    body = json.dumps(kwargs.get("json"), sort_keys=True)
+    return method.upper(), normalize_url(url), str(params), body
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Rate limited request over the shared session, retrying transient errors.
+    Identical requests made at the same time share one response.
+    :param method: HTTP method, ex: GET
+    :param url: URL to request
+    :return: Response object
+    """
+    key = request_key(method, url, **kwargs)
+    if key is None:
+        return send(method, url, **kwargs)
+    return flights.do(key, read, method, url, kwargs)
+
+
+def read(method: str, url: str, kwargs: dict) -> requests.Response:
+    """
+    Make a request and read its body, so the response can be shared between threads.
+    Cached responses are used while fresh, then revalidated with a conditional GET.
+    :param method: HTTP method, ex: GET
+    :param url: URL to request
+    :param kwargs: Arguments for the request
+    :return: Response object with its body read
+    """
+    cacheable = cache.cacheable(method, **kwargs)
+    entry = cache.get(normalize_url(url)) if cacheable else None
+    if entry:
+        if cache.is_fresh(entry):
+            return cached_response(url, entry)
+        kwargs = dict(kwargs, headers=cache.validators(entry))
+
+    r = send(method, url, **kwargs)
+    if entry and r.status_code == 304:
+        # Unchanged since it was cached
+        r.close()
+        cache.revalidated(normalize_url(url))
+        return cached_response(url, entry)
+
+    # Body is read once here, instead of by each thread sharing it
+    if cacheable and r.status_code == 200:
+        cache.put(normalize_url(url), r.headers, r.content)
+    r.content
+    return r
+
+
+def cached_response(url: str, entry: dict) -> requests.Response:
+    """
+    Rebuild a response from the cache.
+    :param url: URL requested
+    :param entry: Cached response
+    :return: Response object holding the cached body
+    """
+    r = requests.Response()
+    r.status_code = 200
+    r.url = url
+    r.headers.update(entry["headers"])
+    r.encoding = requests.utils.get_encoding_from_headers(r.headers)
+    r._content = entry["body"]
+    return r
+
+
+def send(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Rate limited request over the shared session, retrying transient errors.
+    :param method: HTTP method, ex: GET
+    :param url: URL to request
+    :return: Response object
+    """
+    kwargs.setdefault("timeout", TIMEOUT)
+    breaker = get_breaker(url)
+    attempts: dict = {}
+    while True:
+        check_breaker(breaker, url)
+        limit(url)
+        start = time.monotonic()
+        try:
+            r = session.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            error = classify_error(e)
+            if breaker:
+                breaker.record(not error, time.monotonic() - start)
+            wait = retry_delay(error, attempts) if error else None
+            if wait is None:
+                if error:
+                    raise TransientError(f"{error} error for {url}: {e}") from e
+                raise
+        else:
+            error = RETRY_STATUSES.get(r.status_code)
+            if breaker:
+                breaker.record(not error, time.monotonic() - start)
+            if not error:
+                return r
+            wait = retry_delay(error, attempts, r.headers.get("Retry-After"))
+            if wait is None:
+                r.close()
+                raise TransientError(f"{error} error for {url}: {r.status_code}")
+            r.close()
+        time.sleep(wait)
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    """
+    Rate limited GET request over the shared session.
+    :param url: URL to request
+    :return: Response object
+    """
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    """
+    Rate limited POST request over the shared session.
+    :param url: URL to request
+    :return: Response object
+    """
+    return request("POST", url, **kwargs)
+
+
+def download(url: str, path: str) -> dict:
+    """
+    Rate limited file download, streamed to a partial file then moved into place.
+    Threads downloading the same file to the same path share one download.
+    :param url: URL of the file
+    :param path: Path to save the file to
+    :return: ETag, size and hash of the downloaded file
+    """
+    key = ("FILE", normalize_url(url), os.path.abspath(path))
+    return flights.do(key, retry_download, url, path)
+
+
+def retry_download(url: str, path: str) -> dict:
+    """
+    Download a file, retrying transient errors.
+    A download cut off partway is retried, resuming where it stopped.
+    :param url: URL of the file
+    :param path: Path to save the file to
+    :return: ETag, size and hash of the downloaded file
+    """
+    attempts: dict = {}
+    while True:
+        try:
+            return fetch_file(url, path)
+        except requests.RequestException as e:
+            error = classify_error(e)
+            wait = retry_delay(error, attempts) if error else None
+            if wait is None:
+                if error:
+                    raise TransientError(f"{error} error for {url}: {e}") from e
+                raise
+        time.sleep(wait)
+
+
+def fetch_file(url: str, path: str) -> dict:
+    """
+    Stream a file to a partial file then move it into place.
+    A partial file left by an interrupted download is resumed where it stopped.
+    :param url: URL of the file
+    :param path: Path to save the file to
+    :return: ETag, size and hash of the downloaded file
+    """
+    part, offset = get_partial(path, url)
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    with get(url, stream=True, headers=headers) as r:
+        # Partial file is stale, start over
+        if r.status_code == 416:
+            os.remove(part)
+            return fetch_file(url, path)
+        r.raise_for_status()
+
+        # Server ignored the range request
+        if r.status_code != 206:
+            offset = 0
+        with open(part, "ab" if offset else "wb") as f:
+            for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+        return finish_download(part, path, r.headers, offset)
+
+
+def get_partial(path: str, url: str) -> tuple:
+    """
+    Find the partial file for a download, named for its URL so different
+    files saved to the same path never write to the same partial file.
+    :param path: Path the file will be saved to
+    :param url: URL of the file
+    :return: Path of the partial file, and how many bytes it already holds
+    """
+    digest = hashlib.sha1(normalize_url(url).encode()).hexdigest()[:8]
+    part = f"{path}.{digest}.part"
+    return part, os.path.getsize(part) if os.path.isfile(part) else 0
+
+
+def get_expected_size(headers, offset: int) -> Optional[int]:
+    """
+    Total size a download should have once complete.
+    :param headers: Response headers
+    :param offset: Bytes already downloaded before this response
+    :return: Expected size in bytes, None if the server didn't say
+    """
+    if "Content-Length" not in headers or "Content-Encoding" in headers:
+        return None
+    return offset + int(headers["Content-Length"])
+
+
+def finish_download(part: str, path: str, headers, offset: int) -> dict:
+    """
+    Move a completed partial file into place.
+    :param part: Path of the partial file
+    :param path: Path to save the file to
+    :param headers: Headers of the response that completed the file
+    :param offset: Bytes already downloaded before that response
+    :return: ETag, size and hash of the downloaded file
+    """
+    size = os.path.getsize(part)
+    expected = get_expected_size(headers, offset)
+    if expected is not None and size != expected:
+        raise IncompleteDownload(f"Received {size} of {expected} bytes for {path}")
+
+    # Hash the whole file, including any resumed part
+    sha1 = hashlib.sha1()
+    with open(part, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha1.update(chunk)
+    os.replace(part, path)
+    return {"etag": headers.get("ETag"), "size": size, "sha1": sha1.hexdigest()}
@@ -0,0 +1,298 @@
+"""
+THREADED DOWNLOAD PIPELINE
+"""
+from queue import Queue
+from threading import Thread, Lock
+from typing import Callable, Iterable, Union
+from colorama import Style, Fore
+from lib import card as dl
+from lib import settings as cfg
+from lib import core
+from lib import net
+from lib.constants import console
+
+
+class Stage:
+    """
+    Pool of worker threads handling jobs from a bounded queue.
+    Adding a job blocks while the queue is full, holding back earlier stages.
+    """
+
+    def __init__(self, handler: Callable, workers: int, size: int):
+        self.handler = handler
+        self.queue: Queue = Queue(maxsize=size)
+        self.threads = [Thread(target=self.work, daemon=True) for _ in range(workers)]
+        for t in self.threads:
+            t.start()
+
+    def put(self, job) -> None:
+        """
+        Add a job, waiting for room in the queue.
+        :param job: Job passed to the handler
+        """
+        self.queue.put(job)
+
+    def work(self) -> None:
+        """
+        Handle jobs until told to stop.
+        """
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                self.handler(job)
+            except Exception as e:
+                # Keep the worker alive so the queue still drains
+                console.alert(f"{Fore.RED}ERROR:{Style.RESET_ALL} {e}")
+            finally:
+                self.queue.task_done()
+
+    def close(self) -> None:
+        """
+        Wait for every queued job to finish, then stop the workers.
+        """
+        self.queue.join()
+        for _ in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+
+
+class Job:
+    """
+    A line from the card list and the prints resolved for it.
+    """
+
+    def __init__(self, item: str, prints: list):
+        self.item = item
+        self.prints = prints
+        self.results: list = []
+        self.lock = Lock()
+
+
+class PipelineDownload:
+    """
+    Downloads a card list in three stages, each with its own workers:
+    resolve card data from Scryfall, scrape MTG Pics, then download the images.
+    """
+
+    def __init__(self, download):
+        # Download instance collecting fails and basic lands
+        self.download = download
+        self.resolve = Stage(self.resolve_item, cfg.resolve_workers, cfg.queue_size)
+        self.scrape = Stage(self.scrape_card, cfg.scrape_workers, cfg.queue_size)
+        self.fetch = Stage(self.download_card, cfg.download_workers, cfg.queue_size)
+
+    def run(self, cards: Iterable) -> None:
+        """
+        Download every card in the list, returning once all are complete.
+        :param cards: List of card names, detailed card strings, or card data
+        """
+        batch = []
+        try:
+            for card in cards:
+                # Resolve detailed cards in batches
+                if self.download.is_detailed(card):
+                    batch.append(card)
+                    if len(batch) == cfg.batch_size:
+                        self.resolve.put(batch)
+                        batch = []
+                else:
+                    self.resolve.put(card)
+        except Exception as e:
+            # Still finish the cards read so far
+            console.alert(
+                f"{Fore.RED}ERROR:{Style.RESET_ALL} "
+                f"Couldn't read the rest of the list ({e})"
+            )
+        if batch:
+            self.resolve.put(batch)
+
+        # Each stage only feeds the next, so they can be drained in order
+        self.resolve.close()
+        self.scrape.close()
+        self.fetch.close()
+
+    # RESOLVE STAGE
+
+    def resolve_item(self, item) -> None:
+        """
+        Look up the Scryfall data for an item from the card list.
+        :param item: Card name, detailed card string, card data, or batch of detailed cards
+        """
+        if isinstance(item, list):
+            resolved = self.download.resolve_detailed(item)
+            for i in item:
+                if resolved.get(i):
+                    self.start_job(Job(i, [resolved[i]]))
+                else:
+                    self.resolve_detailed(i)
+        elif isinstance(item, dict):
+            self.start_job(Job(item["name"], [item]))
+        elif self.download.is_detailed(item):
+            self.resolve_detailed(item)
+        else:
+            self.resolve_normal(item)
+
+    def resolve_normal(self, card: str) -> None:
+        """
+        Find the prints of a card with no defined set code.
+        :param card: Card name
+        """
+        card = card.replace("\n", "")
+
+        # Basic land?
+        if card in cfg.basic_lands:
+            self.download.basics.append(card)
+            console.tick()
+            return
+        try:
+            # Remove full art entries
+            prints = [
+                c
+                for c in core.search_card_prints(card)
+                if not cfg.exclude_fullart or c["full_art"] is False
+            ]
+        except net.TransientError as e:
+            self.unavailable(card, e)
+            return
+        except Exception:
+            # Try named lookup
+            try:
+                prints = [core.get_card_named(card)]
+            except net.TransientError as e:
+                self.unavailable(card, e)
+                return
+            except Exception:
+                prints = []
+        if not prints:
+            console.out.append(f"{card} not found!")
+            self.download.fails.append(card)
+            console.tick()
+            return
+        self.start_job(Job(card, prints))
+
+    def resolve_detailed(self, item: str) -> None:
+        """
+        Find a card with defined set code.
+        :param item: Card name -- set code
+        """
+        name, set_code = self.download.split_detailed(item)
+        try:
+            self.start_job(Job(item, [core.get_card_named(name, set_code)]))
+        except net.TransientError as e:
+            self.unavailable(item, e)
+        except Exception:
+            console.out.append(f"{name} not found!")
+            self.download.fails.append(item)
+            console.tick()
+
+    def unavailable(self, item: str, error: Exception) -> None:
+        """
+        Record an item that couldn't be looked up because of a transient error.
+        :param item: Line from the card list
+        :param error: Error that outlasted its retries
+        """
+        self.download.unavailable(item, error)
+        self.download.fails.append(item)
+        console.tick()
+
+    def start_job(self, job: Job) -> None:
+        """
+        Pass a job to the scrape stage, every print at once when downloading all.
+        Otherwise only the first print, later prints are tried if it fails.
+        :param job: Job with resolved prints
+        """
+        for c in job.prints if cfg.download_all else job.prints[:1]:
+            self.scrape.put((job, c))
+
+    # SCRAPE STAGE
+
+    def scrape_card(self, task: tuple) -> None:
+        """
+        Create the card object, scraping its MTG Pics code and card page.
+        :param task: Job and the card data of the print to scrape
+        """
+        job, c = task
+        card = self.prepare(c)
+        if card is True or card is None:
+            self.finish(job, c, bool(card))
+        else:
+            self.fetch.put((job, c, card))
+
+    @staticmethod
+    def prepare(c: dict) -> Union[dl.Card, bool, None]:
+        """
+        Create the card object for a print, scraping everything its download needs.
+        :param c: Card data
+        :return: Card object, True if already downloaded, None if it couldn't be created
+        """
+        try:
+            card_class = dl.get_card_class(c)
+            if dl.is_downloaded(c, card_class):
+                return True
+            card = card_class(c)
+            if not cfg.only_scryfall:
+                try:
+                    card.get_mtgp_faces()
+                except net.TransientError as e:
+                    # Fall back on Scryfall without scraping again
+                    card.skip_mtgp(e)
+                except Exception as e:
+                    # MTG Pics page couldn't be scraped, fall back on Scryfall
+                    card.faces, card.error = (None, None), str(e)
+            return card
+        except net.TransientError as e:
+            core.log(c["name"], c["set"], card_id=c.get("id"), reason=str(e))
+            return None
+        except Exception:
+            console.out.append(f"{c.get('name')} not found!")
+            return None
+
+    # DOWNLOAD STAGE
+
+    def download_card(self, task: tuple) -> None:
+        """
+        Download the images of a scraped card.
+        :param task: Job, card data and card object of the print to download
+        """
+        job, c, card = task
+        try:
+            result = card.download()
+        except Exception:
+            console.out.append(f"{c['name']} not found!")
+            result = False
+
+        # MTG Pics was unavailable, try it again after the run
+        if card.deferred:
+            self.download.deferred.append(c)
+            result = True
+        self.finish(job, c, result)
+
+    def finish(self, job: Job, c: dict, result: bool) -> None:
+        """
+        Record the result of a print, then try the next print if one is needed.
+        The next print is handled by this worker, so stages never feed backwards.
+        :param job: Job the print belongs to
+        :param c: Card data of the print
+        :param result: True if the print downloaded
+        """
+        with job.lock:
+            job.results.append(result)
+            i = len(job.results)
+            if cfg.download_all and i < len(job.prints):
+                # Other prints are still downloading
+                return
+            if not cfg.download_all and not result and i < len(job.prints):
+                c = job.prints[i]
+            else:
+                if sum(job.results) == 0:
+                    self.download.fails.append(job.item)
+                console.tick()
+                return
+        card = self.prepare(c)
+        if card is True or card is None:
+            self.finish(job, c, bool(card))
+        else:
+            self.download_card((job, c, card))
@@ -0,0 +1,112 @@
+"""
+SCRYFALL SET METADATA
+"""
+import os
+import json
+import time
+from threading import Lock
+from typing import Optional
+import requests
+from lib import settings as cfg
+from lib import net
+
+# Set fields kept on disk
+SET_KEYS = ["code", "name", "set_type", "parent_set_code", "released_at"]
+
+
+class SetCache:
+    """
+    Every Scryfall set, fetched in one request and kept on disk between runs.
+    Set lookups become dictionary lookups instead of a request per set.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.sets: Optional[dict] = None
+        # Codes Scryfall couldn't find this run, not looked up again
+        self.missing: set = set()
+        self.lock = Lock()
+
+    def load(self) -> dict:
+        """
+        Load the sets from disk, refreshing them from Scryfall once they're too old.
+        :return: Dict of set data keyed by set code
+        """
+        with self.lock:
+            if self.sets is None:
+                fetched, self.sets = self.read()
+                if time.time() - fetched > cfg.sets_refresh * 86400:
+                    try:
+                        self.sets = self.fetch()
+                        self.write()
+                    except (requests.RequestException, ValueError, KeyError):
+                        # Keep using the stale sets until Scryfall is reachable
+                        pass
+            return self.sets
+
+    def read(self) -> tuple:
+        """
+        Read the sets saved on a previous run.
+        :return: Timestamp the sets were fetched, and the dict of set data
+        """
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            return saved["fetched"], saved["sets"]
+        except (OSError, ValueError, KeyError):
+            return 0, {}
+
+    def write(self) -> None:
+        """
+        Save the sets, replacing the previous file in one step.
+        """
+        with open(f"{self.path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({"fetched": time.time(), "sets": self.sets}, f)
+        os.replace(f"{self.path}.tmp", self.path)
+
+    @staticmethod
+    def fetch() -> dict:
+        """
+        Fetch every set from Scryfall.
+        :return: Dict of set data keyed by set code
+        """
+        res = net.get("https://api.scryfall.com/sets")
+        res.raise_for_status()
+        return {s["code"]: {k: s.get(k) for k in SET_KEYS} for s in res.json()["data"]}
+
+    def get(self, code: str) -> Optional[dict]:
+        """
+        Look up a set, fetching it alone if it was released since the last refresh.
+        :param code: Set code, ex: mh2
+        :return: Dict of set data, None if the set doesn't exist
+        """
+        code = code.lower()
+        sets = self.load()
+        if code in sets:
+            return sets[code]
+        if code in self.missing:
+            return None
+        try:
+            res = net.get(f"https://api.scryfall.com/sets/{code}")
+            res.raise_for_status()
+            s = res.json()
+        except (requests.RequestException, ValueError):
+            with self.lock:
+                self.missing.add(code)
+            return None
+        with self.lock:
+            sets[code] = {k: s.get(k) for k in SET_KEYS}
+        return sets[code]
+
+    def set_type(self, code: str, default: Optional[str] = None) -> Optional[str]:
+        """
+        Look up the type of a set.
+        :param code: Set code, ex: mh2
+        :param default: Type to return if the set isn't known
+        :return: Set type, ex: expansion
+        """
+        s = self.load().get(code.lower())
+        return s["set_type"] if s else default
+
+
+sets = SetCache(os.path.join(cfg.folder, "scryfall_sets.json"))
@@ -15,6 +15,8 @@ config.read("config.ini")
 CONSTANTS
 """
 basic_lands = ["Plains", "Island", "Swamp", "Mountain", "Forest"]
+# Max cards resolved in one Scryfall collection request
+batch_size = 75
 with open(os.path.join(cwd, "lib/codes.hjson")) as js:
     replace_sets = hjson.load(js)
 with open(os.path.join(cwd, "lib/links.json")) as js:
@@ -35,16 +37,61 @@ scry = os.path.join(cwd, folder + "/" + config["FILES"]["Scryfall.Art.Folder"])
 mtgp = os.path.join(cwd, folder + "/" + config["FILES"]["MTGPics.Art.Folder"])
 # Output naming convention
 naming = config["FILES"]["Naming.Convention"]
+# Scryfall bulk data file for offline card lookups, blank to use the API
+bulk_data = config["FILES"].get("Scryfall.Bulk.Data", "").strip()
+if bulk_data:
+    bulk_data = os.path.join(cwd, bulk_data)
 
 
 """
 APP SETTINGS
 """
-# Threads per second
+# Threads looking up cards on Scryfall
 try:
-    threads_per_second = int(config["SETTINGS"]["Threads.Per.Second"])
+    resolve_workers = max(1, config["SETTINGS"].getint("Resolve.Workers", fallback=4))
 except ValueError:
-    threads_per_second = 5
+    resolve_workers = 4
+# Threads scraping MTG Pics
+try:
+    scrape_workers = max(1, config["SETTINGS"].getint("Scrape.Workers", fallback=8))
+except ValueError:
+    scrape_workers = 8
+# Threads downloading images
+try:
+    download_workers = max(1, config["SETTINGS"].getint("Download.Workers", fallback=8))
+except ValueError:
+    download_workers = 8
+# Most threads making requests at once
+max_workers = resolve_workers + scrape_workers + download_workers
+# Number of cards waiting in each stage's queue
+try:
+    queue_size = max(0, config["SETTINGS"].getint("Queue.Size", fallback=50))
+except ValueError:
+    queue_size = 50
+# Scryfall search pages fetched ahead of the downloads
+try:
+    page_workers = max(1, config["SETTINGS"].getint("Pages.Ahead", fallback=4))
+except ValueError:
+    page_workers = 4
+# Download engine, threads or async
+engine = config["SETTINGS"].get("Engine", "threads").strip().lower()
+# Cards downloaded at once by the async engine
+try:
+    async_tasks = max(1, config["SETTINGS"].getint("Async.Max.Tasks", fallback=500))
+except ValueError:
+    async_tasks = 500
+# Connections open to each host by the async engine
+try:
+    async_per_host = max(1, config["SETTINGS"].getint("Async.Per.Host", fallback=20))
+except ValueError:
+    async_per_host = 20
+# Processes parsing MTGPics pages, 0 parses in the downloading threads
+try:
+    parse_processes = max(0, config["SETTINGS"].getint("Parse.Processes", fallback=0))
+except ValueError:
+    parse_processes = 0
+# Console output, normal, quiet or progress
+console_mode = config["SETTINGS"].get("Console.Mode", "normal").strip().lower()
 # Download all images available or just most recent?
 download_all = config["SETTINGS"].getboolean("Download.All")
 # Download scryfall if MTGPics missing?
@@ -57,6 +104,11 @@ try:
     only_scryfall = config["SETTINGS"].getboolean("Only.Download.Scryfall")
 except ValueError:
     only_scryfall = False
+# Skip cards already in the download manifest
+try:
+    skip_downloaded = config["SETTINGS"].getboolean("Skip.Downloaded", fallback=False)
+except ValueError:
+    skip_downloaded = False
 # Overwrite previous files
 try:
     overwrite = config["SETTINGS"].getboolean("Overwrite.Same.Name")
@@ -85,3 +137,128 @@ try:
     include_extras = str(bool(config["SEARCH"].getboolean("Include.Extras")))
 except ValueError:
     include_extras = "false"
+
+
+"""
+INDEX SETTINGS
+"""
+# Store resolved MTGPics codes between runs?
+try:
+    index_enabled = config.getboolean("INDEX", "Enabled", fallback=True)
+except ValueError:
+    index_enabled = True
+# Days before an indexed set is scraped again
+try:
+    index_ttl = config.getfloat("INDEX", "TTL.Days", fallback=30)
+except ValueError:
+    index_ttl = 30
+# Per set TTL overrides, ex: pmo:7, sld:7
+index_ttl_sets = {}
+try:
+    for entry in config.get("INDEX", "TTL.Sets", fallback="").split(","):
+        if ":" in entry:
+            code, days = entry.split(":")
+            index_ttl_sets[code.strip().lower()] = float(days)
+except ValueError:
+    index_ttl_sets = {}
+# Days before the Scryfall set list is fetched again
+try:
+    sets_refresh = config.getfloat("INDEX", "Sets.Refresh.Days", fallback=7)
+except ValueError:
+    sets_refresh = 7
+
+
+"""
+HTTP CACHE
+"""
+# Store Scryfall and MTGPics responses between runs?
+try:
+    cache_enabled = config.getboolean("CACHE", "Enabled", fallback=True)
+except ValueError:
+    cache_enabled = True
+# Bytes the cache can grow to before old responses are evicted
+try:
+    cache_size = int(
+        max(0.0, config.getfloat("CACHE", "Max.Size.MB", fallback=256)) * 1048576
+    )
+except ValueError:
+    cache_size = 256 * 1048576
+# Hours a cached response is used before it's revalidated
+try:
+    cache_fresh = max(0.0, config.getfloat("CACHE", "Fresh.Hours", fallback=24))
+except ValueError:
+    cache_fresh = 24
+
+
+"""
+RATE LIMITS
+"""
+# Requests per second allowed for each host, 0 for unlimited
+rate_limits = {}
+if config.has_section("RATE LIMITS"):
+    for host, rate in config["RATE LIMITS"].items():
+        try:
+            rate_limits[host.lower()] = max(0.0, float(rate))
+        except ValueError:
+            pass
+
+
+"""
+RETRIES
+"""
+# Retries allowed per request for each class of transient error
+retry_attempts = {"timeout": 3, "connection": 3, "server": 3, "rate_limited": 5}
+for error, key in [
+    ("timeout", "Timeout"),
+    ("connection", "Connection.Error"),
+    ("server", "Server.Error"),
+    ("rate_limited", "Rate.Limited"),
+]:
+    try:
+        retry_attempts[error] = max(
+            0, config.getint("RETRY", key, fallback=retry_attempts[error])
+        )
+    except ValueError:
+        pass
+# Seconds to wait before the first retry, doubling each retry after
+try:
+    retry_delay = max(0.0, config.getfloat("RETRY", "Backoff.Seconds", fallback=0.5))
+except ValueError:
+    retry_delay = 0.5
+# Longest wait before a retry, including waits asked for by Retry-After
+try:
+    retry_max_delay = max(0.0, config.getfloat("RETRY", "Backoff.Max", fallback=30))
+except ValueError:
+    retry_max_delay = 30
+
+
+"""
+CIRCUIT BREAKER
+"""
+# Skip a host that keeps failing?
+try:
+    breaker_enabled = config.getboolean("CIRCUIT BREAKER", "Enabled", fallback=True)
+except ValueError:
+    breaker_enabled = True
+# Recent requests to each host the error rate is measured over
+try:
+    breaker_window = max(1, config.getint("CIRCUIT BREAKER", "Window", fallback=20))
+except ValueError:
+    breaker_window = 20
+# Share of those requests failing or slow that trips the breaker
+try:
+    breaker_error_rate = config.getfloat("CIRCUIT BREAKER", "Error.Rate", fallback=0.5)
+except ValueError:
+    breaker_error_rate = 0.5
+# Requests slower than this many seconds count as failures
+try:
+    breaker_slow = config.getfloat("CIRCUIT BREAKER", "Slow.Seconds", fallback=10)
+except ValueError:
+    breaker_slow = 10
+# Seconds a tripped host is skipped before it's tested again
+try:
+    breaker_cooldown = config.getfloat(
+        "CIRCUIT BREAKER", "Cooldown.Seconds", fallback=60
+    )
+except ValueError:
+    breaker_cooldown = 60
@@ -3,6 +3,11 @@ BASIC PYTEST MODULE
 """
 import os
 import sys
+import json
+import time
+import asyncio
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
 from pathlib import Path
 
 # Add cwd to path
@@ -10,24 +15,47 @@ sys.path.append(str(Path(os.getcwd())))
 os.chdir(str(Path(os.getcwd()).resolve()))
 import main as app
 import core
+import bulk
+import pipeline
+import mtgpics
+import pytest
+from bs4 import BeautifulSoup
+from constants import Console
+from failures import FailureLog
+from index import Index
+from manifest import Manifest
+import sets
+import net
+import httpcache
+from net import TokenBucket
 
 
 def test_normal_cards():
     dl = app.Download()
-    assert all(dl.download_normal("As Foretold"))  # Normal card
-    assert all(dl.download_normal("Faithbound Judge", True))  # TF card
-    assert all(dl.download_normal("Darkbore Pathway", True))  # MDFC card
-    assert all(dl.download_normal("Fire // Ice", True))  # Split card
-    assert all(dl.download_normal("Geyadrone Dihada", True))  # Planeswalker
+    pipeline.PipelineDownload(dl).run(
+        [
+            "As Foretold",  # Normal card
+            "Faithbound Judge",  # TF card
+            "Darkbore Pathway",  # MDFC card
+            "Fire // Ice",  # Split card
+            "Geyadrone Dihada",  # Planeswalker
+        ]
+    )
+    assert dl.fails == []
 
 
 def test_detailed_cards():
     dl = app.Download()
-    assert dl.download_detailed("2x2--As Foretold")  # Normal card
-    assert dl.download_detailed("vow--Faithbound Judge")  # TF card
-    assert dl.download_detailed("khm--Darkbore Pathway")  # MDFC card
-    assert dl.download_detailed("mh2--Fire // Ice")  # Split card
-    assert dl.download_detailed("mh2--Geyadrone Dihada")  # Planeswalker
+    pipeline.PipelineDownload(dl).run(
+        [
+            "2x2--As Foretold",  # Normal card
+            "vow--Faithbound Judge",  # TF card
+            "khm--Darkbore Pathway",  # MDFC card
+            "mh2--Fire // Ice",  # Split card
+            "mh2--Geyadrone Dihada",  # Planeswalker
+        ]
+    )
+    assert dl.fails == []
 
 
 def test_scryfall_command():
@@ -35,6 +63,25 @@ def test_scryfall_command():
     assert len(dl.start_command(dry_run=True)) == 0
 
 
+def test_async_engine_fallback(monkeypatch):
+    ran = []
+
+    class FakePipeline:
+        def __init__(self, download):
+            pass
+
+        def run(self, cards):
+            ran.extend(cards)
+
+    # Without aiohttp the threads engine downloads the list
+    monkeypatch.setitem(sys.modules, "lib.aio", None)
+    monkeypatch.setattr(app.cfg, "engine", "async")
+    monkeypatch.setattr(app, "PipelineDownload", FakePipeline)
+    assert app.Download.get_async_engine() is None
+    app.Download(card_list=["As Foretold"]).start(dry_run=True)
+    assert ran == ["As Foretold"]
+
+
 def test_mtgp_image_determination():
     longer_string_test = [
         {"src": "pics/art_th/mh2/030b.jpg"},
@@ -74,3 +121,967 @@ def test_mtgp_image_determination():
     assert bigger_number_test == ["050.jpg", "051.jpg"]
     assert underscore_letter_test == ["030_a.jpg", "030_b.jpg"]
     assert underscore_number_test == ["030_1.jpg", "030_2.jpg"]
+
+    # Both faces are picked out in one pass
+    entries = [{"src": "pics/art_th/mh2/030.jpg"}]
+    assert core.get_card_faces(entries) == (
+        "https://mtgpics.com/pics/art/mh2/030.jpg",
+        None,
+    )
+    assert core.get_card_faces([]) == (None, None)
+
+
+def test_mtgp_checklist_lookup(monkeypatch):
+    rows = [
+        {"number": "001", "name": "Fire / Ice", "code": "tst001", "artist": ""},
+        {"number": "002", "name": "Fire", "code": "tst002", "artist": ""},
+        {"number": "003", "name": "Ice ", "code": "tst003", "artist": ""},
+    ]
+    monkeypatch.setitem(
+        core.checklists,
+        "tst",
+        {
+            "rows": rows,
+            "index": {(r["number"], r["name"].strip()): r["code"] for r in rows},
+        },
+    )
+    assert core.get_mtgp_code("tst", "002", "Fire") == "tst002"
+    assert core.get_mtgp_code("tst", "003", "Ice") == "tst003"
+    assert core.get_mtgp_code("tst", "999", "Fire / Ice") == "tst001"
+    assert core.get_mtgp_code("tst", "001", "Missing") is None
+
+
+def test_mtgp_promo_lookup(monkeypatch):
+    rows = [
+        {
+            "number": "1",
+            "name": "Sol Ring Judge",
+            "code": "dci001",
+            "artist": "Mark Tedin",
+        },
+        {
+            "number": "2",
+            "name": "Sol Ring MagicFest",
+            "code": "dci002",
+            "artist": "Mark Tedin",
+        },
+        {
+            "number": "3",
+            "name": "Sol Ring",
+            "code": "dci003",
+            "artist": "Jérôme & Anna",
+        },
+        {
+            "number": "4",
+            "name": "Counterspell",
+            "code": "dci004",
+            "artist": "Mark Tedin",
+        },
+    ]
+    url = f"https://mtgpics.com/set_checklist?set={core.promo_sets['dci']}"
+    monkeypatch.setitem(
+        core.checklists, url, core.index_promo_checklist({"rows": rows, "index": {}})
+    )
+    assert (
+        core.get_mtgp_code_pmo("Sol Ring", "Mark Tedin", "MagicFest", "dci") == "dci002"
+    )
+    assert core.get_mtgp_code_pmo("Sol Ring", "Jerome", "Judge Gift", "dci") == "dci003"
+    assert core.get_mtgp_code_pmo("Sol Ring", "Nobody", "Judge Gift", "dci") is None
+
+
+def test_mtgp_index(tmp_path):
+    idx = Index(str(tmp_path / "index.sqlite3"))
+    idx.set_code("iko", "1", "Adaptive Shimmerer", "iko001")
+    idx.set_images("iko", "iko001", ["pics/art_th/iko/001.jpg"])
+    assert idx.get_code("iko", "1", "Adaptive Shimmerer") == "iko001"
+    assert idx.get_images("iko001") == ["pics/art_th/iko/001.jpg"]
+    assert idx.get_code("iko", "2", "Adaptive Shimmerer") is None
+    assert not idx.expired("iko", time.time())
+    assert idx.expired("iko", 0)
+    assert idx.invalidate("iko") == 2
+    assert idx.get_code("iko", "1", "Adaptive Shimmerer") is None
+    assert idx.get_images("iko001") is None
+
+
+def test_token_bucket():
+    bucket = TokenBucket(50)
+    waits = [bucket.acquire() for _ in range(60)]
+    assert sum(waits[:50]) == 0
+    assert 0 < waits[-1] <= 0.25
+
+
+def test_resolve_detailed_batch(monkeypatch):
+    found = [
+        {"name": "Aegis Turtle", "set": "iko"},
+        {"name": "Fire // Ice", "set": "mh2", "card_faces": [{"name": "Fire"}]},
+    ]
+    monkeypatch.setattr(app.core, "get_cards_collection", lambda ids: found)
+    resolved = app.Download().resolve_detailed(
+        ["iko--Aegis Turtle\n", "Fire // Ice (MH2)", "iko--Missing Card"]
+    )
+    assert resolved["iko--Aegis Turtle\n"] == found[0]
+    assert resolved["Fire // Ice (MH2)"] == found[1]
+    assert resolved["iko--Missing Card"] is None
+
+
+def test_bulk_data(tmp_path):
+    cards = [
+        {
+            "id": str(i),
+            "name": name,
+            "set": set_code,
+            "set_name": set_code.upper(),
+            "set_type": "expansion",
+            "collector_number": str(i),
+            "artist": "Artist",
+            "layout": "normal",
+            "full_art": False,
+            "illustration_id": art,
+            "released_at": released,
+            "image_uris": {"art_crop": "x", "large": "y"},
+        }
+        for i, (name, set_code, art, released) in enumerate(
+            [
+                ("As Foretold", "2x2", "a", "2022-07-08"),
+                ("As Foretold", "akh", "a", "2017-04-28"),
+                ("As Foretold", "sld", "b", "2021-01-01"),
+                ("Anticipate", "iko", "c", "2020-04-24"),
+            ]
+        )
+    ]
+    source = tmp_path / "bulk.json"
+    source.write_text(json.dumps(cards, indent=1), encoding="utf-8")
+    assert [c["id"] for c in bulk.iter_json_array(str(source), 64)] == [
+        "0",
+        "1",
+        "2",
+        "3",
+    ]
+
+    store = bulk.BulkData(str(source), str(tmp_path / "bulk.sqlite3"))
+    assert store.find("as foretold")[0]["set"] == "2x2"
+    assert "large" not in store.find("As Foretold")[0]["image_uris"]
+    assert [c["set"] for c in store.search("As Foretold")] == ["2x2", "sld"]
+    assert store.named("As Foretld")["set"] == "2x2"
+    assert store.named("As Foretold", "akh")["set"] == "akh"
+    assert store.named("Anticip")["set"] == "iko"
+    assert store.named("Nothing Like It") is None
+    assert len(store.collection([{"name": "anticipate", "set": "iko"}])) == 1
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    body = bytes(range(256)) * 64
+
+    def do_GET(self):
+        start = 0
+        if "Range" in self.headers:
+            start = int(self.headers["Range"][6:-1])
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(self.body) - start))
+        self.end_headers()
+        self.wfile.write(self.body[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+def test_resumed_download(tmp_path):
+    server = HTTPServer(("127.0.0.1", 0), RangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/art.jpg"
+    path = str(tmp_path / "art.jpg")
+    try:
+        # Resume a partial download
+        part = net.get_partial(path, url)[0]
+        with open(part, "wb") as f:
+            f.write(RangeHandler.body[:1000])
+        net.download(url, path)
+        assert not os.path.exists(part)
+        with open(path, "rb") as f:
+            assert f.read() == RangeHandler.body
+
+        # Fresh download
+        os.remove(path)
+        net.download(url, path)
+        assert os.path.getsize(path) == len(RangeHandler.body)
+    finally:
+        server.shutdown()
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        # Each print has different art, sent slowly so downloads overlap
+        body = self.path.encode() * 20000
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        for i in range(0, len(body), 20000):
+            self.wfile.write(body[i : i + 20000])
+            time.sleep(0.005)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_same_name_prints(monkeypatch, tmp_path):
+    monkeypatch.setattr(app.dl.cfg, "mtgp", str(tmp_path))
+    monkeypatch.setattr(app.dl.cfg, "overwrite", False)
+    monkeypatch.setattr(app.dl.manifest, "add", lambda *args: None)
+    server = HTTPServer(("127.0.0.1", 0), SlowHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    cards = []
+    for i in range(2):
+        card = app.dl.Card(
+            {
+                "id": str(i),
+                "name": "As Foretold",
+                "set": "akh",
+                "set_name": "Amonkhet",
+                "set_type": "expansion",
+                "collector_number": str(42 + i),
+                "artist": "Kieran Yanner",
+                "image_uris": {"art_crop": "https://x.jpg"},
+            }
+        )
+        card.faces = (f"http://127.0.0.1:{server.server_port}/print{i}", None)
+        cards.append(card)
+
+    # Prints downloading at once are each saved under their own name
+    try:
+        threads = [
+            threading.Thread(target=c.download_mtgp, args=(c.name, c.filename))
+            for c in cards
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        server.shutdown()
+    files = sorted(os.listdir(tmp_path))
+    name = cards[0].filename.replace(".jpg", "")
+    assert files == [f"{name} (1).jpg", f"{name}.jpg"]
+    bodies = {(tmp_path / f).read_bytes() for f in files}
+    assert bodies == {b"/print0" * 20000, b"/print1" * 20000}
+    assert app.dl.claimed == set()
+
+    # A print without an image leaves another print's claim alone
+    for f in files:
+        (tmp_path / f).unlink()
+    path = cards[0].check_path(f"{tmp_path}/{cards[0].filename}")
+    cards[1].faces = (None, None)
+    assert not cards[1].download_mtgp(cards[1].name, cards[1].filename)
+    assert app.dl.claimed == {path}
+    cards[0].release_path(path)
+
+
+def test_manifest(tmp_path):
+    art = tmp_path / "art.jpg"
+    art.write_bytes(b"1234")
+    log = Manifest(str(tmp_path / "manifest.jsonl"))
+    log.add("abc", "front", "mtgp", "https://x", str(art), {"size": 4})
+    assert log.is_complete("abc", 1)
+    assert not log.is_complete("abc", 2)
+    assert not log.is_downloaded("abc", "front", "scryfall")
+
+    # Reloaded from disk, missing files aren't complete
+    log = Manifest(str(tmp_path / "manifest.jsonl"))
+    assert log.is_complete("abc", 1)
+    art.unlink()
+    assert not log.is_complete("abc", 1)
+
+
+def test_scryfall_pages(monkeypatch):
+    class Page:
+        def __init__(self, url):
+            self.page = int(url.split("page=")[1].split("&")[0])
+
+        def json(self):
+            return {"data": [self.page * 10 + i for i in range(2)]}
+
+    monkeypatch.setattr(core.net, "get", Page)
+    pages = core.CardPages(
+        {
+            "data": [10, 11],
+            "has_more": True,
+            "total_cards": 9,
+            "next_page": "https://api.scryfall.com/cards/search?page=2&q=set%3Aiko",
+        }
+    )
+    assert len(pages) == 9
+    assert list(pages) == [10, 11, 20, 21, 30, 31, 40, 41, 50, 51]
+
+    # A page that can't be fetched is reported and skipped
+    def get(url):
+        if "page=3" in url:
+            raise net.TransientError("server error")
+        return Page(url)
+
+    monkeypatch.setattr(core.net, "get", get)
+    assert list(pages) == [10, 11, 20, 21, 40, 41, 50, 51]
+    assert pages.missing == [3]
+
+
+def test_pipeline_print_fallback(monkeypatch):
+    tried = []
+
+    class FakeCard:
+        def __init__(self, c):
+            self.c = c
+            self.code = c["set"]
+            self.deferred = False
+
+        def get_mtgp_faces(self):
+            return None, None
+
+        def download(self):
+            tried.append(self.c["set"])
+            return self.c["set"] != "akh"
+
+    prints = [
+        {"name": "As Foretold", "set": s, "full_art": False}
+        for s in ["akh", "2x2", "sld"]
+    ]
+    monkeypatch.setattr(pipeline.dl, "get_card_class", lambda c: FakeCard)
+    monkeypatch.setattr(pipeline.dl, "is_downloaded", lambda c, cls: False)
+    monkeypatch.setattr(pipeline.core, "search_card_prints", lambda name: prints)
+    dl = app.Download()
+    pipeline.PipelineDownload(dl).run(["As Foretold\n"])
+    assert tried == ["akh", "2x2"]
+    assert dl.fails == []
+
+    # Every print at once when downloading all
+    tried.clear()
+    monkeypatch.setattr(pipeline.cfg, "download_all", True)
+    pipeline.PipelineDownload(dl).run(["As Foretold\n"])
+    assert sorted(tried) == ["2x2", "akh", "sld"]
+    assert dl.fails == []
+    monkeypatch.setattr(pipeline.core, "search_card_prints", lambda name: prints[:1])
+    pipeline.PipelineDownload(dl).run(["As Foretold\n"])
+    assert dl.fails == ["As Foretold"]
+
+    # A list that fails partway still finishes the cards read before it
+    def cards():
+        yield "As Foretold\n"
+        raise net.TransientError("server error")
+
+    tried.clear()
+    pipeline.PipelineDownload(dl).run(cards())
+    assert tried == ["akh"]
+
+
+def test_pipeline_scrape_error(monkeypatch):
+    fallback = []
+
+    def get_mtgp_images(self, mtgp_code):
+        raise IndexError("list index out of range")
+
+    monkeypatch.setattr(pipeline.cfg, "only_scryfall", False)
+    monkeypatch.setattr(pipeline.cfg, "download_scryfall", True)
+    monkeypatch.setattr(pipeline.dl, "is_downloaded", lambda c, cls: False)
+    monkeypatch.setattr(pipeline.dl.Card, "resolve_code", lambda self: "akh042")
+    monkeypatch.setattr(pipeline.dl.Card, "get_mtgp_images", get_mtgp_images)
+    monkeypatch.setattr(
+        pipeline.dl.Card,
+        "download_scryfall",
+        lambda self, name, path, link: fallback.append(name) or True,
+    )
+    c = {
+        "id": "abc",
+        "name": "As Foretold",
+        "set": "akh",
+        "set_name": "Amonkhet",
+        "set_type": "expansion",
+        "collector_number": "42",
+        "artist": "Kieran Yanner",
+        "layout": "normal",
+        "image_uris": {"art_crop": "https://x.jpg"},
+    }
+
+    # A page that can't be parsed falls back on Scryfall
+    card = pipeline.PipelineDownload.prepare(c)
+    assert card.faces == (None, None)
+    assert card.error == "list index out of range"
+    card.download()
+    assert fallback == ["As Foretold"]
+
+    # Prints whose card can't be created are still not found
+    assert pipeline.PipelineDownload.prepare({"name": "As Foretold"}) is None
+
+
+def test_set_cache(tmp_path, monkeypatch):
+    fetched = []
+
+    class Sets:
+        def __init__(self, url, **kwargs):
+            fetched.append(url)
+            self.url = url
+
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            if self.url.endswith("/sets"):
+                return {"data": [{"code": "mh2", "set_type": "draft_innovation"}]}
+            return {"code": "xyz", "set_type": "expansion"}
+
+    monkeypatch.setattr(sets.net, "get", Sets)
+    cache = sets.SetCache(str(tmp_path / "sets.json"))
+    assert cache.set_type("MH2") == "draft_innovation"
+    assert cache.get("xyz")["set_type"] == "expansion"
+    assert cache.get("mh2")["set_type"] == "draft_innovation"
+    assert len(fetched) == 2
+
+    # Loaded from disk on the next run
+    assert (
+        sets.SetCache(str(tmp_path / "sets.json")).set_type("mh2") == "draft_innovation"
+    )
+    assert len(fetched) == 2
+
+    # Unknown sets are only looked up once
+    def missing(url, **kwargs):
+        fetched.append(url)
+        raise sets.requests.HTTPError("404 Not Found")
+
+    monkeypatch.setattr(sets.net, "get", missing)
+    assert cache.get("nope") is None
+    assert cache.get("NOPE") is None
+    assert len(fetched) == 3
+
+
+def read_fixture(name: str) -> bytes:
+    with open(os.path.join(os.path.dirname(__file__), "fixtures", name), "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("backend", ["lxml", "fallback"])
+def test_mtgpics_parsers(backend, monkeypatch):
+    if backend == "fallback":
+        monkeypatch.setattr(mtgpics, "lxml_html", None)
+    elif mtgpics.lxml_html is None:
+        pytest.skip("lxml not installed")
+
+    # Checklist rows match the BeautifulSoup parser
+    content = read_fixture("mtgp_checklist.html")
+    soup = BeautifulSoup(content, "html.parser")
+    expected = []
+    for row in soup.find_all("div", {"style": mtgpics.ROW_STYLE}):
+        cols = row.find_all("td")
+        if len(cols) < 3 or not cols[2].find("a"):
+            continue
+        expected.append(
+            {
+                "number": cols[0].text,
+                "name": cols[2].text,
+                "code": cols[2].find("a")["href"].replace("card?ref=", ""),
+                "artist": cols[6].text if len(cols) > 6 else "",
+            }
+        )
+    rows = mtgpics.parse_checklist(content)
+    assert rows == expected
+    assert [r["code"] for r in rows] == ["iko001", "iko226", "iko275a"]
+    assert rows[1]["name"] == "Fire & Ice (Promo)"
+    assert rows[1]["artist"] == "Jérôme Thomas"
+
+    # Card page images and set link match the BeautifulSoup parser
+    content = read_fixture("mtgp_card.html")
+    soup = BeautifulSoup(content, "html.parser")
+    images = mtgpics.parse_card_images(content)
+    assert images == [
+        img["src"] for img in soup.find_all("img", {"style": mtgpics.IMG_STYLE})
+    ]
+    entries = [{"src": src} for src in images]
+    assert core.get_card_face(entries) == "https://mtgpics.com/pics/art/eld/039.jpg"
+    assert (
+        core.get_card_face(entries, True)
+        == "https://mtgpics.com/pics/art/eld/039_1.jpg"
+    )
+    td = soup.find("td", {"width": "170", "align": "center"})
+    assert mtgpics.parse_set_link(content) == td.find("a")["href"] == "set?set=309"
+    assert mtgpics.parse_card_images(b"") == []
+
+
+def test_parse_process_pool(monkeypatch):
+    content = read_fixture("mtgp_checklist.html")
+    expected = mtgpics.parse_checklist(content)
+    monkeypatch.setattr(mtgpics.cfg, "parse_processes", 2)
+    monkeypatch.setattr(mtgpics, "executor", None)
+    try:
+        assert mtgpics.offload(mtgpics.parse_checklist, content) == expected
+        assert mtgpics.get_executor() is mtgpics.executor
+    finally:
+        mtgpics.executor.shutdown()
+
+
+def test_console_modes(capsys):
+    for mode in ["normal", "quiet", "progress"]:
+        console = Console(mode)
+        threading.Thread(target=console.wait, daemon=True).start()
+        console.start(4)
+        console.out.append("MTGP: As Foretold [AKH]")
+        console.alert("FAILED: Missing Card [IKO]")
+        console.tick(2)
+        console.flush()
+        out = capsys.readouterr().out
+        assert "FAILED: Missing Card" in out
+        assert ("MTGP: As Foretold" in out) == (mode == "normal")
+        assert ("2/4 cards" in out) == (mode == "progress")
+
+
+def test_failure_log(tmp_path):
+    log = FailureLog(str(tmp_path / "logs"))
+    threads = [
+        threading.Thread(target=log.add, args=(f"Card {i}", "iko", "failed", str(i)))
+        for i in range(20)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    log.add("Fire // Ice", "", "failed_back", "x", "scryfall")
+    assert not (tmp_path / "logs").exists()
+
+    log.flush()
+    failed = (tmp_path / "logs" / "failed.txt").read_text(encoding="utf-8")
+    assert sorted(failed.splitlines()) == sorted(f"iko--Card {i}" for i in range(20))
+    back = (tmp_path / "logs" / "failed_back.txt").read_text(encoding="utf-8")
+    assert back == "Fire // Ice\n"
+    with open(tmp_path / "logs" / "failures.jsonl", encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f]
+    assert len(entries) == 21
+    assert entries[-1]["source"] == "scryfall"
+    assert entries[-1]["reason"] == "Back image not found"
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    # Statuses to send before succeeding
+    statuses: list = []
+
+    def do_GET(self):
+        status = FlakyHandler.statuses.pop(0) if FlakyHandler.statuses else 200
+        self.send_response(status)
+        if status == 429:
+            self.send_header("Retry-After", "0")
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+def test_retry_policy(monkeypatch):
+    monkeypatch.setattr(net.cfg, "cache_enabled", False)
+    monkeypatch.setattr(net.cfg, "retry_delay", 0.01)
+    monkeypatch.setattr(
+        net.cfg,
+        "retry_attempts",
+        {"timeout": 1, "connection": 1, "server": 2, "rate_limited": 1},
+    )
+    # Backoff doubles with jitter, Retry-After is honored up to the max
+    assert 0 <= net.retry_delay("server", {"server": 1}) <= 0.02
+    assert net.retry_delay("server", {"server": 2}) is None
+    assert net.retry_delay("rate_limited", {}, "1.5") == 1.5
+    assert net.retry_delay("rate_limited", {}, "999999") == net.cfg.retry_max_delay
+
+    server = HTTPServer(("127.0.0.1", 0), FlakyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/card"
+    try:
+        # Transient errors are retried within each class's budget
+        FlakyHandler.statuses = [503, 429, 502]
+        assert net.get(url).content == b"ok"
+
+        # Out of retries, kept apart from real misses
+        FlakyHandler.statuses = [503, 503, 503]
+        with pytest.raises(net.TransientError):
+            net.get(url)
+        FlakyHandler.statuses = [404]
+        assert net.get(url).status_code == 404
+    finally:
+        server.shutdown()
+
+
+def test_circuit_breaker(monkeypatch):
+    monkeypatch.setattr(net.cfg, "breaker_window", 4)
+    monkeypatch.setattr(net.cfg, "breaker_error_rate", 0.5)
+    monkeypatch.setattr(net.cfg, "breaker_slow", 1)
+    monkeypatch.setattr(net.cfg, "breaker_cooldown", 0.05)
+    monkeypatch.setattr(net, "breakers", {})
+    url = "http://127.0.0.1:9/card?ref=iko001"
+    breaker = net.get_breaker(url)
+    assert net.get_breaker("http://www.127.0.0.1/") is breaker
+
+    # Slow and failed requests trip the breaker
+    for ok, elapsed in [(True, 0.1), (False, 0.1), (True, 5), (True, 0.1)]:
+        assert breaker.allow()
+        breaker.record(ok, elapsed)
+    assert not breaker.allow()
+    with pytest.raises(net.CircuitOpen):
+        net.get(url)
+
+    # After the cooldown a single request tests the host
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record(True, 0.1)
+    assert breaker.allow()
+    assert breaker.remaining() == 0
+
+
+class CachingHandler(BaseHTTPRequestHandler):
+    # Status of each response sent
+    sent: list = []
+
+    def do_GET(self):
+        if self.headers.get("If-None-Match") == '"v1"':
+            CachingHandler.sent.append(304)
+            self.send_response(304)
+            self.end_headers()
+            return
+        CachingHandler.sent.append(200)
+        body = self.path.encode()
+        self.send_response(200)
+        self.send_header("ETag", '"v1"')
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_http_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(net, "cache", httpcache.ResponseCache(str(tmp_path / "c.db")))
+    monkeypatch.setattr(net.cfg, "cache_enabled", True)
+    monkeypatch.setattr(net.cfg, "cache_fresh", 0)
+    server = HTTPServer(("127.0.0.1", 0), CachingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/card?ref=iko001"
+    try:
+        # Stale responses are revalidated, unchanged ones come from the cache
+        assert net.get(url).content == b"/card?ref=iko001"
+        r = net.get(url)
+        assert r.status_code == 200 and r.content == b"/card?ref=iko001"
+        assert r.headers["ETag"] == '"v1"'
+        assert CachingHandler.sent == [200, 304]
+
+        # Fresh responses aren't requested at all
+        monkeypatch.setattr(net.cfg, "cache_fresh", 1)
+        assert net.get(url).content == b"/card?ref=iko001"
+        assert CachingHandler.sent == [200, 304]
+    finally:
+        server.shutdown()
+
+    # Least recently used responses are evicted to fit the size
+    cache = httpcache.ResponseCache(str(tmp_path / "lru.db"))
+    monkeypatch.setattr(net.cfg, "cache_size", 10)
+    cache.put("a", {}, b"aaaa")
+    time.sleep(0.01)
+    cache.put("b", {}, b"bbbb")
+    time.sleep(0.01)
+    assert cache.get("a")
+    cache.put("c", {}, b"cccc")
+    assert cache.get("b") is None
+    assert cache.get("a")["body"] == b"aaaa" and cache.get("c")
+    assert cache.size == 8
+
+    # Lookups and writes are committed in batches, then all at once when flushed
+    assert cache.pending == 3 and "a" in cache.used
+    cache.flush()
+    assert cache.pending == 0 and cache.used == {}
+    reopened = httpcache.ResponseCache(str(tmp_path / "lru.db"))
+    assert reopened.get("a")["body"] == b"aaaa" and reopened.get("b") is None
+    assert not httpcache.ResponseCache.cacheable("GET", stream=True)
+    assert not httpcache.ResponseCache.cacheable("POST")
+
+
+def test_invalidate_cache(monkeypatch, tmp_path):
+    cache = httpcache.ResponseCache(str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(app.net, "cache", cache)
+    monkeypatch.setattr(app.core, "cache", cache)
+    monkeypatch.setattr(app, "index", Index(str(tmp_path / "index.sqlite3")))
+    monkeypatch.setattr(app.net.cfg, "cache_enabled", True)
+    monkeypatch.setattr(app.net.cfg, "cache_fresh", 1)
+    monkeypatch.setattr(app.net.cfg, "index_enabled", True)
+    pages = {
+        "https://www.mtgpics.com/card?ref=eld001": read_fixture("mtgp_card.html"),
+        "https://mtgpics.com/set_checklist?set=309": read_fixture(
+            "mtgp_checklist.html"
+        ),
+        "https://www.mtgpics.com/card?ref=eld115a": b"indexed",
+        "https://www.mtgpics.com/card?ref=eld116": b"guessed",
+        "https://www.mtgpics.com/card?ref=mh2001": b"other set",
+    }
+    for url, body in pages.items():
+        cache.put(app.net.normalize_url(url), {}, body)
+    app.index.set_code("eld", "115", "Bonecrusher Giant / Stomp", "eld115a")
+    sent = []
+
+    def send(method, url, **kwargs):
+        sent.append(url)
+        r = app.net.requests.Response()
+        r.status_code, r._content = 200, pages[url]
+        return r
+
+    # Fresh pages come from the cache until their set is invalidated
+    monkeypatch.setattr(app.net, "send", send)
+    for url in pages:
+        assert app.net.get(url).content == pages[url]
+    assert sent == []
+    app.Download.invalidate(["ELD"])
+    assert app.index.get_set_codes("eld") == []
+    for url in pages:
+        assert app.net.get(url).content == pages[url]
+    assert sent == list(pages)[:4]
+
+
+def test_retry_deferred(monkeypatch):
+    monkeypatch.setattr(app.net.cfg, "breaker_cooldown", 0.05)
+    monkeypatch.setattr(app.net, "breakers", {})
+    logged = []
+    monkeypatch.setattr(
+        app.core, "log", lambda name, *args, **kwargs: logged.append(name)
+    )
+    breaker = app.net.get_breaker("https://www.mtgpics.com")
+    cards = [{"name": f"Card {i}", "set": "iko", "id": str(i)} for i in range(8)]
+    tried = []
+
+    def retry_card(ok):
+        def retry(c):
+            # Each card makes a request to MTGPics
+            tried.append(c["name"])
+            if not breaker.allow():
+                return False
+            time.sleep(0.01)
+            breaker.record(ok, 0.1)
+            return ok
+
+        return staticmethod(retry)
+
+    # One card tests MTGPics, then every other card is retried
+    monkeypatch.setattr(app.Download, "retry_card", retry_card(True))
+    breaker.opened = time.monotonic()
+    dl = app.Download()
+    dl.deferred = list(cards)
+    dl.retry_deferred()
+    assert sorted(tried) == sorted(c["name"] for c in cards)
+    assert dl.fails == [] and logged == []
+
+    # Still failing, the rest aren't sent into the open breaker
+    tried.clear()
+    monkeypatch.setattr(app.Download, "retry_card", retry_card(False))
+    breaker.opened = time.monotonic()
+    dl.deferred = list(cards)
+    dl.retry_deferred()
+    assert tried == ["Card 0"]
+    assert dl.fails == [c["name"] for c in cards]
+    assert logged == [c["name"] for c in cards[1:]]
+
+
+def test_lazy_mtgp_code(monkeypatch):
+    def request(method, url, **kwargs):
+        raise AssertionError(f"Unexpected request to {url}")
+
+    monkeypatch.setattr(app.net, "request", request)
+    monkeypatch.setattr(app.dl.Card, "download_scryfall", lambda *args: True)
+    card = app.dl.Card(
+        {
+            "id": "abc",
+            "name": "As Foretold",
+            "set": "akh",
+            "set_name": "Amonkhet",
+            "set_type": "expansion",
+            "collector_number": "42",
+            "artist": "Kieran Yanner",
+            "image_uris": {"art_crop": "https://cards.scryfall.io/art_crop/x.jpg"},
+        }
+    )
+    assert card.code is None
+
+    # Scryfall only downloads never resolve the MTGP code
+    monkeypatch.setattr(app.dl.cfg, "only_scryfall", True)
+    assert card.download()
+    assert card.code is None
+
+
+def test_mdfc_single_scrape(monkeypatch):
+    scraped, downloaded = [], []
+
+    class Response:
+        content = read_fixture("mtgp_card.html")
+
+    def get(url, **kwargs):
+        scraped.append(url)
+        time.sleep(0.05)
+        return Response()
+
+    def download(url, path, **kwargs):
+        downloaded.append(url)
+        return {}
+
+    monkeypatch.setattr(app.net, "get", get)
+    monkeypatch.setattr(app.net, "download", download)
+    monkeypatch.setattr(app.dl.index, "get_images", lambda code: None)
+    monkeypatch.setattr(app.dl.index, "set_images", lambda *args: None)
+    monkeypatch.setattr(app.dl.manifest, "add", lambda *args: None)
+    monkeypatch.setattr(app.dl.cfg, "only_scryfall", False)
+    monkeypatch.setattr(app.dl.cfg, "overwrite", True)
+    card = app.dl.MDFC(
+        {
+            "id": "abc",
+            "name": "Bonecrusher Giant // Stomp",
+            "set": "eld",
+            "set_name": "Throne of Eldraine",
+            "set_type": "expansion",
+            "collector_number": "115",
+            "artist": "Victor Adame Minguez",
+            "card_faces": [
+                {"name": name, "image_uris": {"art_crop": "https://x.jpg"}}
+                for name in ["Bonecrusher Giant", "Stomp"]
+            ],
+        }
+    )
+    card.code = "eld115"
+
+    # One card page scrape picks out both faces, downloaded together
+    assert card.download()
+    assert scraped == ["https://www.mtgpics.com/card?ref=eld115"]
+    assert sorted(downloaded) == [
+        "https://mtgpics.com/pics/art/eld/039.jpg",
+        "https://mtgpics.com/pics/art/eld/039_1.jpg",
+    ]
+    assert card.faces == core.get_card_faces(
+        [{"src": "pics/art_th/eld/039.jpg"}, {"src": "pics/art_th/eld/039_1.jpg"}]
+    )
+
+
+def test_single_flight():
+    flights = net.SingleFlight()
+    calls = []
+    gate = threading.Event()
+
+    def fetch(url):
+        calls.append(url)
+        gate.wait(5)
+        return {"url": url}
+
+    # Threads asking at the same time share one call and its result
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(flights.do(("GET", "a"), fetch, "a"))
+        )
+        for _ in range(5)
+    ]
+    for t in threads:
+        t.start()
+    while not flights.calls:
+        time.sleep(0.01)
+    time.sleep(0.05)
+    gate.set()
+    for t in threads:
+        t.join()
+    assert calls == ["a"]
+    assert len(results) == 5 and all(r is results[0] for r in results)
+    assert flights.calls == {}
+
+    # Nothing is kept once the call finishes, and errors are shared too
+    def fail():
+        raise net.TransientError("server error")
+
+    assert flights.do(("GET", "a"), fetch, "a") == {"url": "a"}
+    assert calls == ["a", "a"]
+    with pytest.raises(net.TransientError):
+        flights.do(("GET", "b"), fail)
+
+    # Requests are keyed by their normalized form
+    assert net.request_key(
+        "get", "https://www.mtgpics.com/card?ref=eld115&x=1"
+    ) == net.request_key("GET", "https://mtgpics.com/card?x=1&ref=eld115")
+    assert net.request_key("GET", "https://x.com", stream=True) is None
+    assert net.request_key(
+        "POST", core.collection_url, json={"identifiers": [1]}
+    ) != net.request_key("POST", core.collection_url, json={"identifiers": [2]})
+
+
+def test_async_checklist_scrape(monkeypatch):
+    aio = pytest.importorskip("lib.aio")
+    fetched = []
+
+    async def get(self, url, **kwargs):
+        fetched.append(url)
+        if "set_checklist" in url:
+            return read_fixture("mtgp_checklist.html")
+        return read_fixture("mtgp_card.html")
+
+    def request(method, url, **kwargs):
+        raise AssertionError(f"Blocking request to {url}")
+
+    monkeypatch.setattr(aio.AsyncDownload, "get", get)
+    monkeypatch.setattr(aio.net, "request", request)
+    monkeypatch.setattr(aio.core, "checklists", {})
+    monkeypatch.setattr(aio.index, "get_code", lambda *args: None)
+    monkeypatch.setattr(aio.index, "set_code", lambda *args: None)
+    cards = [
+        app.dl.Card(
+            {
+                "id": num,
+                "name": name,
+                "set": "iko",
+                "set_name": "Ikoria: Lair of Behemoths",
+                "set_type": "expansion",
+                "collector_number": num,
+                "artist": "Alex Konstad",
+                "image_uris": {"art_crop": "https://x.jpg"},
+            }
+        )
+        for num, name in [("001", "Adaptive Shimmerer"), ("275", "Zilortha")]
+    ]
+
+    # Checklists are fetched as coroutines, once for every card in the set
+    engine = aio.AsyncDownload(app.Download())
+
+    async def resolve():
+        return await asyncio.gather(*[engine.resolve_code(card) for card in cards])
+
+    codes = asyncio.run(resolve())
+    assert codes == ["iko001", "iko275a"]
+    assert fetched == [
+        "https://www.mtgpics.com/card?ref=iko001",
+        "https://mtgpics.com/set_checklist?set=309",
+    ]
+
+
+def test_async_mtgp_name(monkeypatch):
+    aio = pytest.importorskip("lib.aio")
+    indexed = []
+    monkeypatch.setattr(aio.index, "get_code", lambda *args: None)
+    monkeypatch.setattr(aio.index, "set_code", lambda *args: indexed.append(args))
+    monkeypatch.setitem(
+        aio.core.checklists,
+        "eld",
+        aio.core.index_checklist(
+            [{"number": "115", "name": "Bonecrusher Giant / Stomp", "code": "eld115a"}]
+        ),
+    )
+    card = {
+        "id": "abc",
+        "name": "Bonecrusher Giant // Stomp",
+        "set": "eld",
+        "set_name": "Throne of Eldraine",
+        "set_type": "expansion",
+        "collector_number": "115",
+        "artist": "Victor Adame Minguez",
+        "image_uris": {"art_crop": "https://x.jpg"},
+        "card_faces": [{"name": "Bonecrusher Giant"}, {"name": "Stomp"}],
+    }
+
+    # Both engines look adventures up under their MTG Pics name
+    engine = aio.AsyncDownload(app.Download())
+    assert asyncio.run(engine.resolve_code(app.dl.Adventure(card))) == "eld115a"
+    assert app.dl.Adventure(card).resolve_code() == "eld115a"
+    assert indexed == [("eld", "115", "Bonecrusher Giant / Stomp", "eld115a")] * 2
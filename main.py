@@ -4,16 +4,19 @@ APP TO EXECUTE THE SEARCH
 import os
 import re
 import sys
-import time
-import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import freeze_support
 from typing import Union, Optional
-from time import perf_counter
-from urllib import parse
-import requests as req
+from time import perf_counter, sleep
 from lib import card as dl
 from lib import settings as cfg
 from lib import core
+from lib import net
 from lib.constants import console
+from lib.failures import failures
+from lib.httpcache import cache
+from lib.index import index
+from lib.pipeline import PipelineDownload
 from colorama import Style, Fore
 
 cwd = os.getcwd()
@@ -22,10 +25,13 @@ os.system("")
 
 
 class Download:
-    def __init__(self, command: str = None, card_list: Union[str, list] = None):
-        self.thr: list = []
+    def __init__(
+        self, command: str = None, card_list: Union[str, list, core.CardPages] = None
+    ):
         self.fails: list = []
         self.basics: list = []
+        # Cards sent to Scryfall while MTGPics was unavailable
+        self.deferred: list = []
         if not card_list:
             self.list = cfg.cardlist
         else:
@@ -39,6 +45,9 @@ class Download:
         """
         # Valid command received?
         if isinstance(self.command, str):
+            if self.command.lower().startswith("invalidate "):
+                self.invalidate(self.command[11:].split(","))
+                return self.fails
             if ":" in self.command:
                 self.list = core.get_list_from_scryfall(self.command)
             else:
@@ -65,7 +74,7 @@ class Download:
                     cards.remove(" ")
                 except ValueError:
                     pass
-        elif isinstance(self.list, list):
+        elif isinstance(self.list, (list, core.CardPages)):
             cards = self.list
         else:
             print(f"{Fore.RED}---- NO CARD LIST FOUND! ----{Style.RESET_ALL}")
@@ -77,29 +86,16 @@ class Download:
                 f"{Fore.GREEN}---- Downloading {len(cards)} cards! ----{Style.RESET_ALL}"
             )
 
-        # For each card create new thread
-        for i, card in enumerate(cards):
-            # Detailed card including set?
-            if isinstance(card, dict):
-                self.thr.append(
-                    threading.Thread(target=self.download_dict, args=(card,))
-                )
-            elif "--" in card or " (" in card:
-                self.thr.append(
-                    threading.Thread(target=self.download_detailed, args=(card,))
-                )
-            else:
-                self.thr.append(
-                    threading.Thread(target=self.download_normal, args=(card,))
-                )
+        # Track progress through the list
+        console.start(len(cards))
+
+        # Download using coroutines?
+        engine = self.get_async_engine() if cfg.engine == "async" else None
+        (engine or PipelineDownload)(self).run(cards)
 
-            # Start thread, then sleep to manage thread overload
-            self.thr[i].start()
-            time.sleep(float(1 / cfg.threads_per_second))
+        # Try MTGPics again for cards that skipped it
+        self.retry_deferred()
 
-        # Ensure each thread completes
-        for t in self.thr:
-            t.join()
         # Check for basics encountered
         for b in self.basics:
             self.download_basic(b)
@@ -108,69 +104,40 @@ class Download:
         if not dry_run:
             self.complete(int(perf_counter() - self.time))
 
-    def download_normal(self, card: str, disable_all: bool = False) -> list:
+    @staticmethod
+    def get_async_engine():
         """
-        Download a card with no defined set code.
-        :param card: Card name
-        :param disable_all: Disable download all
+        Load the asyncio download engine, which requires aiohttp.
+        :return: AsyncDownload class, None if aiohttp isn't installed
         """
-        # Remove line break
-        card = card.replace("\n", "")
-        results = []
-
-        # Basic land?
-        if card in cfg.basic_lands:
-            self.basics.append(card)
-            return [True]
         try:
-            # Retrieve scryfall data
-            r = req.get(
-                f'https://api.scryfall.com/cards/search?q=!"{parse.quote(card)}"'
-                f"&unique={cfg.unique}"
-                f"&include_extras={cfg.include_extras}"
-                "&order=released"
-            ).json()
-
-            # Remove full art entries
-            # Add our numbered sets
-            prepared = []
-            for t in r["data"]:
-                # No fullart to exclude?
-                if not cfg.exclude_fullart or t["full_art"] is False:
-                    prepared.append(t)
-
-            # Loop through prints of this card
-            for c in prepared:
-                card_class = dl.get_card_class(c)
-                result = card_class(c).download()
-                # If we're not downloading all, break
-                if (not cfg.download_all or disable_all) and result:
-                    results = [True]
-                    break
-                results.append(result)
+            # Imported here so aiohttp is only required for the async engine
+            from lib.aio import AsyncDownload
+        except ImportError:
+            console.alert(
+                f"{Fore.YELLOW}The async engine requires aiohttp, downloading with "
+                f"threads instead. Install it with: poetry install -E async"
+                f"{Style.RESET_ALL}"
+            )
+            return None
+        return AsyncDownload
 
-        except Exception:
-            # Try named lookup
-            try:
-                c = req.get(
-                    f"https://api.scryfall.com/cards/named?fuzzy={parse.quote(card)}"
-                ).json()
-                card_class = dl.get_card_class(c)
-                result = card_class(c).download()
-            except Exception:
-                console.out.append(f"{card} not found!")
-                result = False
-            results.append(result)
-        if sum(results) == 0:
-            self.fails.append(card)
-        return results
-
-    def download_detailed(self, item: str) -> bool:
+    @staticmethod
+    def is_detailed(card: Union[str, dict]) -> bool:
+        """
+        Check if this is a detailed card including set.
+        :param card: Card name, detailed card string, or dict of card data
+        :return: True if the card string defines a set code
+        """
+        return isinstance(card, str) and ("--" in card or " (" in card)
+
+    @staticmethod
+    def split_detailed(item: str) -> tuple:
         """
-        Download card with defined set code.
-        :param item: Card name -- set code
+        Separate a detailed card string into its name and set code.
+        :param item: Card name -- set code, or Card name (set code)
+        :return: Tuple of card name and set code
         """
-        # Setup card detailed
         if " (" in item:
             reg = r"(.*) \((.*)\)"
             card = re.findall(reg, item)[0]
@@ -180,41 +147,109 @@ class Download:
             card = item.split("--")
             set_code = card[0]
             name = card[1]
-        name = name.replace("\n", "")
+        return name.replace("\n", ""), set_code
 
-        # Try to find the card
+    def resolve_detailed(self, items: list) -> dict:
+        """
+        Look up a batch of detailed cards using the Scryfall collection endpoint.
+        :param items: List of detailed card strings
+        :return: Dict of card data for each detailed card string that was matched
+        """
+        identifiers = []
+        for item in items:
+            name, set_code = self.split_detailed(item)
+            identifiers.append({"name": name, "set": set_code.lower()})
         try:
-            # Lookup card
-            c = req.get(
-                f"https://api.scryfall.com/cards/named?"
-                f"fuzzy={parse.quote(name)}"
-                f"&set={parse.quote(set_code.lower())}"
-            ).json()
-            card_class = dl.get_card_class(c)
-            result = card_class(c).download()
+            cards = core.get_cards_collection(identifiers)
         except Exception:
-            console.out.append(f"{name} not found!")
-            result = False
-        if not result:
-            self.fails.append(item)
-        return result
+            return {}
+        return self.match_detailed(items, identifiers, cards)
+
+    @staticmethod
+    def match_detailed(items: list, identifiers: list, cards: list) -> dict:
+        """
+        Match the cards returned for a batch back to the detailed card strings.
+        :param items: List of detailed card strings
+        :param identifiers: Name and set identifier for each detailed card string
+        :param cards: List of card data returned for the batch
+        :return: Dict of card data for each detailed card string that was matched
+        """
+        # Index the results by set and name, including face names
+        found: dict = {}
+        for c in cards:
+            names = [c["name"]] + [f["name"] for f in c.get("card_faces", [])]
+            for name in names:
+                found.setdefault((c["set"], name.lower()), c)
+        return {
+            item: found.get((i["set"], i["name"].lower()))
+            for item, i in zip(items, identifiers)
+        }
 
-    def download_dict(self, card: dict):
+    def retry_deferred(self) -> None:
         """
-        Downloads a card with previously fetched scryfall data.
-        :param card: Dict of card data
-        :return: True if succeeded, False if not
+        Try MTGPics again for cards sent to Scryfall while it was unavailable.
+        Waits out the MTGPics circuit breaker's cooldown, then retries one card at a
+        time until a test request closes the breaker, before retrying the rest at once.
+        """
+        if not self.deferred:
+            return
+        breaker = net.get_breaker("https://www.mtgpics.com")
+        wait = breaker.remaining() if breaker else 0
+        console.alert(
+            f"Retrying {len(self.deferred)} cards on MTGPics in {wait:.0f} seconds..."
+        )
+        sleep(wait)
+        pending, self.deferred = self.deferred, []
+        results = []
+
+        # Only one request tests a recovering host, retry cards alone until it closes
+        while pending and breaker and breaker.half_open():
+            c = pending.pop(0)
+            results.append((c, self.retry_card(c)))
+
+        if breaker and breaker.remaining():
+            # Still failing, the cards keep their Scryfall images
+            for c in pending:
+                core.log(
+                    c["name"],
+                    c["set"],
+                    card_id=c.get("id"),
+                    reason=f"{breaker.host} is still unavailable",
+                )
+                results.append((c, False))
+        elif pending:
+            with ThreadPoolExecutor(max_workers=cfg.download_workers) as pool:
+                results.extend(zip(pending, pool.map(self.retry_card, pending)))
+        for c, result in results:
+            if not result:
+                self.fails.append(c["name"])
+
+    @staticmethod
+    def retry_card(c: dict) -> bool:
+        """
+        Download a deferred card from MTGPics, without falling back on Scryfall again.
+        :param c: Card json data
+        :return: True if the card downloaded
         """
-        # Try to download the card
         try:
-            card_class = dl.get_card_class(card)
-            result = card_class(card).download()
+            card = dl.get_card_class(c)(c)
+            card.fallback, card.defer, card.deferred = False, False, False
+            return card.download()
         except Exception:
-            console.out.append(f"{card['name']} not found!")
-            result = False
-        if not result:
-            self.fails.append(card["name"])
-        return result
+            console.out.append(f"{c['name']} not found!")
+            return False
+
+    @staticmethod
+    def unavailable(item: str, error: Exception) -> None:
+        """
+        Log a card that couldn't be looked up because of a transient error.
+        It's written to failed.txt for a rerun, kept apart from cards that weren't found.
+        :param item: Line from the card list
+        :param error: Error that outlasted its retries
+        """
+        item = item.replace("\n", "")
+        console.alert(f"{Fore.RED}UNAVAILABLE:{Style.RESET_ALL} {item} ({error})")
+        failures.add(item, "", reason=str(error))
 
     @staticmethod
     def download_basic(card: str):
@@ -230,16 +265,31 @@ class Download:
         while True:
             if len(land_set) >= 3:
                 try:
-                    c = req.get(
-                        f"https://api.scryfall.com/cards/named?fuzzy={parse.quote(card)}"
-                        f"&set={parse.quote(land_set)}"
-                    ).json()
+                    c = core.get_card_named(card, land_set)
                     dl.Land(c).download()
                     break
                 except Exception:
-                    console.out.append("Scryfall couldn't find this set. Try again!")
+                    console.alert("Scryfall couldn't find this set. Try again!")
             else:
-                console.out.append("Error! Illegitimate set. Try again!")
+                console.alert("Error! Illegitimate set. Try again!")
+
+    @staticmethod
+    def invalidate(sets: list) -> None:
+        """
+        Remove sets from the MTGP index and cache so they are scraped again next run.
+        :param sets: List of set codes
+        """
+        for set_code in sets:
+            set_code = set_code.strip().lower()
+            if set_code:
+                codes = index.get_set_codes(set_code)
+                removed = index.invalidate(set_code)
+                evicted = core.forget_mtgp_set(set_code, codes)
+                console.alert(
+                    f"Invalidated {removed} indexed entries and {evicted} cached pages "
+                    f"for [{set_code.upper()}]"
+                )
+        console.flush()
 
     @staticmethod
     def complete(elapsed: int):
@@ -247,8 +297,10 @@ class Download:
         Tell the user the download process is complete.
         :param elapsed: Time to complete downloads (seconds)
         """
-        console.out.append(f"Downloads finished in {elapsed} seconds!")
-        console.out.append(
+        failures.flush()
+        cache.flush()
+        console.alert(f"Downloads finished in {elapsed} seconds!")
+        console.alert(
             "\nAll available files downloaded.\n"
             "See failed.txt for images that couldn't be located.\n"
             "Press enter to exit :)"
@@ -259,6 +311,8 @@ class Download:
 
 
 if __name__ == "__main__":
+    # Parse processes need this in a frozen executable
+    freeze_support()
 
     print(f"{Fore.YELLOW}{Style.BRIGHT}\n")
     print("  ██████╗ ███████╗████████╗   ███╗   ███╗████████╗ ██████╗ ")
@@ -281,9 +335,20 @@ if __name__ == "__main__":
     choice = input(
         "Please view the README for detailed instructions.\n"
         "Cards in cards.txt can either be listed as 'Name' or 'SET--Name'\n"
+        "Enter 'invalidate SET' to rescrape a set from MTGPics on the next run\n"
         "Full Github and README available at: mprox.link/art-downloader\n"
     )
 
+    # Use the asyncio engine?
+    if "--async" in sys.argv:
+        cfg.engine = "async"
+
+    # Hide card messages, or show a progress bar instead?
+    if "--quiet" in sys.argv:
+        console.mode = "quiet"
+    elif "--progress" in sys.argv:
+        console.mode = "progress"
+
     # If the command is valid, download based on that, otherwise cards.txt
     if choice != "":
         print()  # Add newline gap